@@ -27,16 +27,20 @@
 
 import os
 import subprocess
+import sys
 import tempfile
+from collections import deque
 
-from qgis.PyQt.QtCore import QSize, Qt
-from qgis.PyQt.QtGui import QPainter, QImage
+from qgis.PyQt.QtCore import QRectF, QSize, Qt
+from qgis.PyQt.QtGui import QColor, QPainter, QImage
 from qgis.PyQt.QtWidgets import QStyleOptionGraphicsItem
 from qgis.PyQt.QtXml import QDomDocument
 
 from qgis.core import *
 from qgis._3d import *
 from .gui.utils import mesh_layer_active_dataset_group_with_maximum_timesteps
+from .mesh_cache import dataset_times
+from .frame_manifest import FrameManifest, config_hash
 
 
 def _page_size(layout):
@@ -45,91 +49,195 @@ def _page_size(layout):
     return main_page.pageSize()
 
 
-def animation(cfg, progress_fn=None):
+def _frame_time(referenceTime, time):
+    """ returns QDateTime and formatted text of the time [h] relative to the reference time """
+    currentTime=referenceTime.addMSecs(int(time)*3600*1000)
+    return currentTime, currentTime.toString("yyyy-MM-dd HH:mm:ss")
+
+
+def animation(cfg, progress_fn=None, sink=None):
+    """ render frames of the animation and write them to the sink,
+    by default as PNG images to cfg['tmp_imgfile'].
+
+    Frames already written by an interrupted export with the same
+    configuration are not rendered again """
     dpi = 96
     cfg["dpi"] = dpi
     l = cfg['layer']
     w, h = cfg['img_size']
-    imgfile = cfg['tmp_imgfile']
+    if sink is None:
+        sink = ImageFileSink(cfg['tmp_imgfile'], config_key(cfg))
     layers = cfg['layers'] if 'layers' in cfg else [l.id()]
     extent = cfg['extent'] if 'extent' in cfg else l.extent()
     crs = cfg['crs'] if 'crs' in cfg else None
     dataset_group_index = mesh_layer_active_dataset_group_with_maximum_timesteps(l)
     assert (dataset_group_index is not None)
-    count = l.dataProvider().datasetCount(dataset_group_index)
+    times = dataset_times(l, dataset_group_index)
+    count = len(times)
     assert (count > 2)
 
     if 'time' in cfg:
         time_from, time_to = cfg['time']
     else:
-        time_from = l.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, 0)).time()
-        time_to = l.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, count - 1)).time()
+        time_from = times[0]
+        time_to = times[-1]
 
 
-    # count actual timesteps to animate
-    act_count = 0
-    for i in range(count):
-        time = l.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, i)).time()
-        if time_from <= time <= time_to:
-            act_count += 1
-
     # Reference time
     referenceTime=l.temporalProperties().referenceTime()
 
-    # animate
-    imgnum = 0
-    for i in range(count):
+    # numbers and times of the frames to animate
+    frames = [(n + 1, t) for n, t in enumerate(t for t in times if time_from <= t <= time_to)]
+    first_time = frames[0][1] if frames else times[0]
+    frames = [(n, t) for n, t in frames if not sink.has(n)]
+
+    # the layout is built only once, frames differ just by the time label and temporal range of maps
+    # (the time label is sized to the text of the first frame)
+    layout, w = prepare_animation_layout(cfg, (w, h), extent, layers, crs, _frame_time(referenceTime, first_time)[1])
 
+    # maps of the default layout can be rendered separately, templates may have map frames, grids etc.
+    parallel = cfg.get('parallel_frames', 1)
+    if parallel > 1 and cfg['layout']['type'] == 'default':
+        export_frames_parallel(layout, frames, referenceTime, (w, h), dpi, parallel, sink, progress_fn)
+    else:
+        export_frames(layout, frames, referenceTime, (w, h), dpi, sink, progress_fn)
+
+    if progress_fn:
+        progress_fn(count, count)
+
+
+def _layout_maps(layout):
+    # or isinstance(layoutItem, QgsLayoutItem3DMap): (commented because not found in API)
+    return [item for item in layout.items() if isinstance(item, QgsLayoutItemMap)]
+
+
+def export_frames(layout, frames, referenceTime, img_size, dpi, sink, progress_fn=None):
+    """ render frames at times one by one with QgsLayoutExporter and write them to the sink """
+    maps = _layout_maps(layout)
+    layout_exporter = QgsLayoutExporter(layout)
+
+    for imgnum, (number, time) in enumerate(frames):
         if progress_fn:
-            progress_fn(imgnum, act_count)
-
-        time = l.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, i)).time()
-        if time < time_from or time > time_to:
-            continue
-
-        currentTime=referenceTime.addMSecs(int(time)*3600*1000)
-        formattedTime=currentTime.toString("yyyy-MM-dd HH:mm:ss")
-
-        # Prepare layout
-        layout = QgsPrintLayout(QgsProject.instance())
-        layout.initializeDefaults()
-        layout.setName('crayfish')
-
-        layoutcfg = cfg['layout']
-        if layoutcfg['type'] == 'file':
-            prepare_composition_from_template(layout, cfg['layout']['file'], formattedTime)
-            # when using composition from template, match video's aspect ratio to paper size
-            # by updating video's width (keeping the height)
-            aspect = _page_size(layout).width() / _page_size(layout).height()
-            w = int(round(aspect * h))
-        else:  # type == 'default'
-            layout.renderContext().setDpi(dpi)
-            layout.setUnits(QgsUnitTypes.LayoutUnit.LayoutMillimeters)
-            main_page = layout.pageCollection().page(0)
-            main_page.setPageSize(QgsLayoutSize(w * 25.4 / dpi, h * 25.4 / dpi, QgsUnitTypes.LayoutUnit.LayoutMillimeters))
-            prepare_composition(layout, formattedTime, cfg, layoutcfg, extent, layers, crs)
+            progress_fn(imgnum, len(frames))
+
+        currentTime, formattedTime = _frame_time(referenceTime, time)
+        composition_set_time(layout, formattedTime)
 
         #Set timerange for map layouts
         timeRange = QgsDateTimeRange(currentTime, currentTime.addSecs(1))
-        for layoutItem in layout.items():
-            if isinstance(layoutItem, QgsLayoutItemMap): # or isinstance(layoutItem, QgsLayoutItem3DMap): (commented because not found in API)
-                layoutItem.setTemporalRange(timeRange)
-
-        imgnum += 1
-        fname = imgfile % imgnum
-        layout_exporter = QgsLayoutExporter(layout)
-        image_export_settings = QgsLayoutExporter.ImageExportSettings()
-        image_export_settings.dpi = dpi
-        image_export_settings.imageSize = QSize(w, h)
-        res = layout_exporter.exportToImage(os.path.abspath(fname), image_export_settings)
-        if res != QgsLayoutExporter.ExportResult.Success:
+        for layout_map in maps:
+            layout_map.setTemporalRange(timeRange)
+
+        image = layout_exporter.renderPageToImage(0, QSize(*img_size), dpi)
+        if image.isNull():
             raise RuntimeError()
+        sink.write(image, number)
 
-    if progress_fn:
-        progress_fn(count, count)
 
+def export_frames_parallel(layout, frames, referenceTime, img_size, dpi, in_flight, sink, progress_fn=None):
+    """ render frames at times with maps of up to in_flight frames rendered at once
+
+    Every map item is rendered by its own QgsMapRendererParallelJob with a copy of the item's
+    map settings and the temporal range of the frame. The rest of the layout is then drawn
+    over the map images. Map item frames, grids and overviews are not drawn, so this is meant
+    for layouts with plain maps like the default one. Images are written to the sink in order of frames """
+    w, h = img_size
+    page_size = _page_size(layout)
+    sx, sy = w / page_size.width(), h / page_size.height()
+
+    maps = _layout_maps(layout)
+    targets = []
+    for layout_map in maps:
+        pos = layout.convertToLayoutUnits(layout_map.positionWithUnits())
+        size = layout.convertToLayoutUnits(layout_map.sizeWithUnits())
+        rect = QRectF(pos.x() * sx, pos.y() * sy, size.width() * sx, size.height() * sy)
+        settings = layout_map.mapSettings(layout_map.extent(), rect.size(), dpi, True)
+        settings.setIsTemporal(True)
+        targets.append((rect, settings))
+
+    items = [item for item in layout.items() if isinstance(item, QgsLayoutItem) and not isinstance(item, QgsLayoutItemPage)]
+    visibility = [item.isVisible() for item in items]
+    exporter = QgsLayoutExporter(layout)
+    try:
+        # page background without any items
+        for item in items:
+            item.setVisibility(False)
+        background = exporter.renderPageToImage(0, QSize(w, h), dpi)
+
+        # the other items on transparent background without maps
+        for item, visible in zip(items, visibility):
+            item.setVisibility(visible and not isinstance(item, QgsLayoutItemMap))
+        layout.renderContext().setPagesVisible(False)
+
+        pending = deque()
+        written = 0
+        for number, time in frames:
+            currentTime, formattedTime = _frame_time(referenceTime, time)
+            timeRange = QgsDateTimeRange(currentTime, currentTime.addSecs(1))
+            jobs = []
+            for rect, settings in targets:
+                frame_settings = QgsMapSettings(settings)
+                frame_settings.setTemporalRange(timeRange)
+                job = QgsMapRendererParallelJob(frame_settings)
+                job.start()
+                jobs.append((rect, job))
+            pending.append((number, formattedTime, jobs))
+
+            while len(pending) >= in_flight or (pending and written + len(pending) == len(frames)):
+                if progress_fn:
+                    progress_fn(written, len(frames))
+                number, formattedTime, jobs = pending.popleft()
+                sink.write(_compose_parallel_frame(layout, exporter, background, (w, h), dpi, formattedTime, jobs), number)
+                written += 1
+    finally:
+        layout.renderContext().setPagesVisible(True)
+        for item, visible in zip(items, visibility):
+            item.setVisibility(visible)
+
+
+def _compose_parallel_frame(layout, exporter, background, img_size, dpi, formattedTime, jobs):
+    composition_set_time(layout, formattedTime)
+    overlay = exporter.renderPageToImage(0, QSize(*img_size), dpi)
+
+    image = background.copy()
+    painter = QPainter(image)
+    for rect, job in jobs:
+        job.waitForFinished()
+        painter.drawImage(rect, job.renderedImage())
+    painter.drawImage(0, 0, overlay)
+    painter.end()
+    return image
 
-def traceAnimation(cfg, progress_fn=None):
+
+def prepare_animation_layout(cfg, img_size, extent, layers, crs, formattedTime):
+    """ return layout for animation frames and width of the frames in pixels
+
+    When using composition from template, the width is updated to match
+    video's aspect ratio to paper size (keeping the height) """
+    dpi = cfg['dpi']
+    w, h = img_size
+
+    layout = QgsPrintLayout(QgsProject.instance())
+    layout.initializeDefaults()
+    layout.setName('crayfish')
+
+    layoutcfg = cfg['layout']
+    if layoutcfg['type'] == 'file':
+        prepare_composition_from_template(layout, cfg['layout']['file'], formattedTime)
+        aspect = _page_size(layout).width() / _page_size(layout).height()
+        w = int(round(aspect * h))
+    else:  # type == 'default'
+        layout.renderContext().setDpi(dpi)
+        layout.setUnits(QgsUnitTypes.LayoutUnit.LayoutMillimeters)
+        main_page = layout.pageCollection().page(0)
+        main_page.setPageSize(QgsLayoutSize(w * 25.4 / dpi, h * 25.4 / dpi, QgsUnitTypes.LayoutUnit.LayoutMillimeters))
+        prepare_composition(layout, formattedTime, cfg, layoutcfg, extent, layers, crs)
+    return layout, w
+
+
+def traceAnimation(cfg, progress_fn=None, sink=None):
+    """ render frames of the particle trace animation and write them to the sink,
+    by default as PNG images to cfg['tmp_imgfile'] """
     dpi = 96
     cfg["dpi"] = dpi
     l = cfg['layer']
@@ -137,7 +245,8 @@ def traceAnimation(cfg, progress_fn=None):
     w, h = cfg['img_size']
     fps = cfg['fps']
     duration = cfg['duration']
-    imgfile = cfg['tmp_imgfile']
+    if sink is None:
+        sink = ImageFileSink(cfg['tmp_imgfile'])
     count = cfg['count']
     maxSpeed = cfg['max_speed']
     lifeTime = cfg['life_time']
@@ -184,19 +293,26 @@ def traceAnimation(cfg, progress_fn=None):
     particlesRenderer.setTailPersitence(persistence)
 
     framesCount=duration*fps
-    #start to increment and generate image
-    for i in range(framesCount):
 
-        if progress_fn:
-            progress_fn(i, framesCount)
-
-        particleImage = particlesRenderer.imageRendered()
-        renderImage=underLayerImage.copy()
-        painter=QPainter()
-        painter.begin(renderImage)
-        painter.drawImage(0,0,particleImage)
+    # all frames are composed in the same image with the same painter,
+    # the sink gets the image itself, so there is no allocation per frame
+    renderImage = underLayerImage.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+    painter = QPainter(renderImage)
+    try:
+        #start to increment and generate image
+        for i in range(framesCount):
+
+            if progress_fn:
+                progress_fn(i, framesCount)
+
+            particleImage = particlesRenderer.imageRendered()
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+            painter.drawImage(0, 0, underLayerImage)
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+            painter.drawImage(0, 0, particleImage)
+            sink.write(renderImage, i + 1)
+    finally:
         painter.end()
-        renderImage.save(imgfile% (i+1),"PNG")
     if progress_fn:
         progress_fn(framesCount, framesCount)
 
@@ -322,17 +438,156 @@ def prepare_composition(layout, time, cfg, layoutcfg, extent, layers, crs):
         set_item_pos(cLegend, itemcfg['position'], layout)
 
 
-def images_to_video(tmp_img_dir="/tmp/vid/%05d.png", output_file="/tmp/vid/test.avi", fps=10, qual=1,
-                    ffmpeg_bin="ffmpeg", keep_intermediate_images=False):
+def _video_options(qual):
     if qual == 0:  # lossless
-        opts = ["-vcodec", "ffv1"]
-    else:
-        bitrate = 10000 if qual == 1 else 2000
-        opts = ["-vcodec", "mpeg4", "-b", str(bitrate) + "K"]
+        return ["-vcodec", "ffv1"]
+    bitrate = 10000 if qual == 1 else 2000
+    return ["-vcodec", "mpeg4", "-b", str(bitrate) + "K"]
+
+
+def _file_state(path):
+    """ return path, modification time and size of a file, None if it is not a file on disk """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return [os.path.abspath(path), st.st_mtime_ns, st.st_size]
+
+
+def _layer_state(layer):
+    """ return what the rendering of the layer depends on: its source, the state of its files and its style """
+    style = QgsMapLayerStyle()
+    style.readFromLayer(layer)
+    paths = [QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')]
+    if isinstance(layer, QgsMeshLayer) and layer.dataProvider() is not None:
+        paths += list(layer.dataProvider().extraDatasets())
+    return [layer.id(), layer.source(), [_file_state(path) for path in paths], style.xmlData()]
+
+
+def _config_value(value):
+    """ return JSON serializable representation of objects in animation config """
+    if isinstance(value, QgsMapLayer):
+        return _layer_state(value)
+    if isinstance(value, QColor):
+        return value.name(QColor.NameFormat.HexArgb)
+    if isinstance(value, QgsCoordinateReferenceSystem):
+        return value.toWkt()
+    if hasattr(value, 'toString'):  # QFont, QgsRectangle
+        return value.toString()
+    return repr(value)
+
+
+def config_key(cfg):
+    """ return hash of animation config, frames of exports with the same key are the same """
+    cfg = dict(cfg)
+    # rendered layers may be given by their ids
+    if 'layers' in cfg:
+        cfg['layers'] = [QgsProject.instance().mapLayer(layer) if isinstance(layer, str) else layer
+                         for layer in cfg['layers']]
+    template = cfg.get('layout', {}).get('file')
+    if template and os.path.exists(template):
+        cfg['template_mtime'] = os.path.getmtime(template)
+    return config_hash(cfg, ('tmp_imgfile', 'parallel_frames'), _config_value)
+
+
+class ImageFileSink:
+    """ writes frames as PNG images named by a template with the frame number, e.g. /tmp/%05d.png
+
+    With a config key, written frames are recorded in a manifest next to the images,
+    so an interrupted export with the same key can skip them """
+
+    MANIFEST_NAME = 'crayfish_animation.txt'
+
+    def __init__(self, template, key=None):
+        self.template = template
+        self.manifest = None
+        if key is not None:
+            path = os.path.join(os.path.dirname(os.path.abspath(template)), self.MANIFEST_NAME)
+            self.manifest = FrameManifest(path, key, template)
+
+    def has(self, number):
+        """ whether the frame has been already written """
+        return self.manifest is not None and self.manifest.has(number)
+
+    def write(self, image, number):
+        if not image.save(os.path.abspath(self.template % number), "PNG"):
+            raise RuntimeError()
+        if self.manifest is not None:
+            self.manifest.add(number)
+
+    def close(self):
+        pass
+
+
+class FfmpegPipeSink:
+    """ streams frames as raw video to stdin of ffmpeg, which is started with the first frame
+
+    After close(), ok tells whether the video has been written
+    and logfile is the path to the ffmpeg output, which is kept only on failure.
+    broken tells whether a write failed because ffmpeg has quit """
+
+    def __init__(self, output_file, fps=10, qual=1, ffmpeg_bin="ffmpeg"):
+        self.output_file = output_file
+        self.fps = fps
+        self.qual = qual
+        self.ffmpeg_bin = ffmpeg_bin
+        self.process = None
+        self.log = tempfile.NamedTemporaryFile(prefix="crayfish", suffix=".txt", delete=False)
+        self.logfile = self.log.name
+        self.ok = False
+        self.broken = False
+
+    def _start(self, width, height):
+        # QImage ARGB32 pixels are 32-bit integers 0xAARRGGBB in native byte order
+        pix_fmt = "bgra" if sys.byteorder == "little" else "argb"
+        cmd = [self.ffmpeg_bin, "-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", "{}x{}".format(width, height),
+               "-framerate", str(self.fps), "-i", "-"]
+        cmd += _video_options(self.qual)
+        cmd += ["-r", str(self.fps), "-f", "avi", "-y", self.output_file]
+        self.log.write(str.encode(" ".join(cmd) + "\n\n"))
+        self.log.flush()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self.log, stderr=self.log)
+
+    # formats with the same memory layout as the raw video, alpha is ignored by the encoders
+    RAW_FORMATS = (QImage.Format.Format_ARGB32, QImage.Format.Format_ARGB32_Premultiplied, QImage.Format.Format_RGB32)
+
+    def has(self, number):
+        return False
+
+    def write(self, image, number):
+        if image.format() not in self.RAW_FORMATS:
+            image = image.convertToFormat(QImage.Format.Format_ARGB32)
+        if self.process is None:
+            self._start(image.width(), image.height())
+        # the pixels are passed without a copy
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        try:
+            self.process.stdin.write(memoryview(bits))
+        except OSError:  # ffmpeg has quit, e.g. because of invalid options
+            self.broken = True
+            raise RuntimeError("FFmpeg failed, see " + self.logfile)
+
+    def close(self):
+        """ finish the video and wait for ffmpeg, can be called more times """
+        if self.process is not None and self.process.returncode is None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.ok = self.process.wait() == 0
+        if not self.log.closed:
+            self.log.close()
+            # the log is kept when ffmpeg has failed, to be attached to bug reports
+            if self.ok or self.process is None:
+                os.remove(self.logfile)
+
 
+def images_to_video(tmp_img_dir="/tmp/vid/%05d.png", output_file="/tmp/vid/test.avi", fps=10, qual=1,
+                    ffmpeg_bin="ffmpeg", keep_intermediate_images=False):
     # if images do not start with 1: -start_number 14
     cmd = [ffmpeg_bin, "-f", "image2", "-framerate", str(fps), "-i", tmp_img_dir]
-    cmd += opts
+    cmd += _video_options(qual)
     cmd += ["-r", str(fps), "-f", "avi", "-y", output_file]
 
     f = tempfile.NamedTemporaryFile(prefix="crayfish", suffix=".txt")
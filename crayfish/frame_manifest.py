@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import hashlib
+import json
+import os
+
+
+def config_hash(cfg, ignored=(), default=repr):
+    """ return hash of a config dict without the ignored keys,
+    values which are not JSON serializable are converted with default() """
+    data = {k: v for k, v in cfg.items() if k not in ignored}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=default).encode('utf-8')).hexdigest()
+
+
+class FrameManifest:
+    """ text file with the config key on the first line followed by numbers
+    of frames written by an export with that key, one per line
+
+    Numbers are appended as frames are written. Frames recorded for a different
+    key are removed, so that they do not get into a video of the new export """
+
+    def __init__(self, path, key, template):
+        self.path = path
+        self.key = key
+        self.template = template
+        self.frames = set()
+
+        lines = []
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            pass
+
+        numbers = [int(line) for line in lines[1:] if line.strip().isdigit()]  # the last line may be cut off
+        if lines and lines[0] == key:
+            self.frames = set(numbers)
+        else:
+            for number in numbers:
+                try:
+                    os.remove(template % number)
+                except OSError:
+                    pass
+            with open(path, 'w') as f:
+                f.write(key + '\n')
+
+    def has(self, number):
+        """ whether the frame has been written and its file still exists """
+        return number in self.frames and os.path.exists(self.template % number)
+
+    def add(self, number):
+        self.frames.add(number)
+        with open(self.path, 'a') as f:
+            f.write('{}\n'.format(number))
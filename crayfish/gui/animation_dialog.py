@@ -25,17 +25,16 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
-import shutil
-import tempfile
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtCore import *
 from qgis.core import *
 
-from ..animation import animation, images_to_video
+from ..animation import animation, images_to_video, FfmpegPipeSink
 from .utils import load_ui, time_to_string, mesh_layer_active_dataset_group_with_maximum_timesteps,handle_ffmpeg
 from .install_helper import downloadFfmpeg
+from ..mesh_cache import dataset_times
 
 uiDialog, qtBaseClass = load_ui('crayfish_animation_dialog_widget')
 
@@ -84,9 +83,8 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
         if (dataset_group_index is None) or (dataset_group_index < 0):
             return
 
-        for i in range(self.l.dataProvider().datasetCount(dataset_group_index)):
-            meta = self.l.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, i))
-            cbo.addItem(time_to_string(self.l, meta.time()), meta.time())
+        for time in dataset_times(self.l, dataset_group_index):
+            cbo.addItem(time_to_string(self.l, time), float(time))
 
     def browseOutput(self):
         settings = QSettings()
@@ -150,16 +148,14 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
 
         self.buttonBox.setEnabled(False)
 
-        tmpdir = tempfile.mkdtemp(prefix='crayfish')
+        # without intermediate images the frames are streamed to ffmpeg directly
         deleteIntermediateImages = self.radDelTmpImg.isChecked()
-
-        if not deleteIntermediateImages:
-            tmpdir = self.editImgTmpPath.text()
+        tmpdir = None if deleteIntermediateImages else self.editImgTmpPath.text()
 
         w = self.spinWidth.value()
         h = self.spinHeight.value()
         fps = self.spinSpeed.value()
-        img_output_tpl = os.path.join(tmpdir, "%05d.png")
+        img_output_tpl = os.path.join(tmpdir, "%05d.png") if tmpdir else None
 
         tmpl = None # path to template file to be used
 
@@ -175,6 +171,9 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
               'extent'     : self.r.extent(),
               'crs'        : self.r.mapSettings().destinationCrs(),
               'layout'     : {},
+              # number of frames rendered at once (opt-in, frames of the default layout are then composed
+              # from separately rendered maps), 1 to export frames one by one with QgsLayoutExporter
+              'parallel_frames': self.spinParallelFrames.value(),
             }
 
         if self.radLayoutDefault.isChecked():
@@ -189,25 +188,33 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
             d['layout']['type'] = 'file'
             d['layout']['file'] = self.editTemplate.text()
 
-        animation(d, prog)
-
-        ffmpeg_res, logfile = images_to_video(img_output_tpl, output_file, fps, self.quality(), ffmpeg_bin)
-
-        if ffmpeg_res and deleteIntermediateImages:
-            shutil.rmtree(tmpdir)
-
-        QApplication.restoreOverrideCursor()
-
-        self.updateProgress(0,1)
-
-        self.buttonBox.setEnabled(True)
+        try:
+            if deleteIntermediateImages:
+                sink = FfmpegPipeSink(output_file, fps, self.quality(), ffmpeg_bin)
+                try:
+                    animation(d, prog, sink)
+                except RuntimeError:
+                    if not sink.broken:  # ffmpeg is fine, the rendering has failed
+                        raise
+                finally:
+                    sink.close()
+                ffmpeg_res, logfile = sink.ok, sink.logfile
+            else:
+                animation(d, prog)
+                ffmpeg_res, logfile = images_to_video(img_output_tpl, output_file, fps, self.quality(), ffmpeg_bin)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+            self.updateProgress(0,1)
+
+            self.buttonBox.setEnabled(True)
 
         if ffmpeg_res:
             QMessageBox.information(self, "Export", "The export of animation was successful!")
         else:
             QMessageBox.warning(self, "Export",
-                "An error occurred when converting images to video. "
-                "The images are still available in " + tmpdir + "\n\n"
+                "An error occurred when converting images to video. " +
+                ("The images are still available in " + tmpdir + "\n\n" if tmpdir else "\n\n") +
                 "This should not happen. Please file a ticket in "
                 "Crayfish issue tracker with the contents from the log file:\n" + logfile)
 
@@ -263,6 +270,7 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
         s.setValue("quality", self.quality())
         s.setValue("ffmpeg", "system" if self.radFfmpegSystem.isChecked() else "custom")
         s.setValue("ffmpeg_path", self.editFfmpegPath.text())
+        s.setValue("parallel_frames", self.spinParallelFrames.value())
 
 
     def restoreDefaults(self):
@@ -279,6 +287,8 @@ class CrayfishAnimationDialog(qtBaseClass, uiDialog):
                 self.setTimeInCombo(self.cboEnd, s.value(k,type=float))
             elif k == 'fps':
                 self.spinSpeed.setValue(s.value(k,type=int))
+            elif k == 'parallel_frames':
+                self.spinParallelFrames.setValue(s.value(k,type=int))
             elif k == 'layout_type':
                 if s.value(k) == "file":
                     self.radLayoutCustom.setChecked(True)
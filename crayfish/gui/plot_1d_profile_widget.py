@@ -29,6 +29,9 @@ from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtCore import *
 
 import math
+from functools import partial
+
+import numpy as np
 
 from qgis._core import QgsPointXY
 from qgis.core import *
@@ -36,6 +39,7 @@ from qgis.gui import *
 from qgis.utils import iface
 
 from .plot_map_layer_widget import MapLayersWidget
+from ..mesh_cache import EdgeGraphTask, lookup, mesh_edges
 
 
 class PickProfileTool(QgsMapTool):
@@ -66,36 +70,38 @@ class Profile1DPickerWidget(QToolButton):
 
     PICK_NO, PICK_MAP, PICK_LAYER = range(3)
 
+    PICK_TEXT = "Select profile from map"
+
     def __init__(self, parent=None):
         QToolButton.__init__(self, parent)
 
         self.setToolTip("Select point to define a longitudinal profile (ctrl for intermediate point) ")
 
-        self.setText("Select profile from map")
+        self.setText(self.PICK_TEXT)
         self.setCheckable(True)
         self.clicked.connect(self.picker_clicked)
 
         self.pick_mode = self.PICK_NO
         self.pick_layer = None
 
-        self.vectorLayer = None
         self.meshLayer = None
-        self.tracer = QgsTracer()
-        self.tracer.setDestinationCrs(iface.mapCanvas().mapSettings().destinationCrs(),
-                                      iface.mapCanvas().mapSettings().transformContext())
+        # traces are lists of indexes of mesh vertices
         self.temporaryTrace = []
         self.profileTrace = []
 
-        self.firstVertex = QgsPointXY()
+        self.firstVertex = -1
         self.firstVertexMarker = None
         self.profileHighlight = None
 
+        # background task building the network of the mesh 1D edges
+        self.graph_task = None
+
         self.tool = PickProfileTool(iface.mapCanvas())
         self.tool.picked.connect(self.on_picked)
         self.tool.setButton(self)
 
     def clear_geometries(self):
-        self.firstVertex = QgsPointXY()
+        self.firstVertex = -1
         self.temporaryTrace = []
         self.profileTrace = []
         self.clear_marker()
@@ -108,6 +114,8 @@ class Profile1DPickerWidget(QToolButton):
             self.start_picking_map()
 
     def start_picking_map(self):
+        if self.meshLayer is not None and not self.prepare_graph():
+            iface.messageBar().pushWarning("Crayfish", "The mesh layer has no 1D edges to pick a profile on")
         self.pick_mode = self.PICK_MAP
         iface.mapCanvas().setMapTool(self.tool)
         self.clear_geometries()
@@ -118,7 +126,7 @@ class Profile1DPickerWidget(QToolButton):
 
         self.profileTrace.extend(self.temporaryTrace)
         self.temporaryTrace = []
-        self.firstVertex = QgsPointXY()
+        self.firstVertex = -1
 
         self.updateMarker()
 
@@ -132,37 +140,42 @@ class Profile1DPickerWidget(QToolButton):
             self.stop_picking()
             return;
 
+        graph = self.graph()
+        if graph is None:
+            self.prepare_graph()
+            return
+
         searchradius=self.tool.searchRadiusMU(iface.mapCanvas())
-        vertexMapPosition=self.meshLayer.snapOnElement(QgsMesh.ElementType.Vertex,point,searchradius)
+        vertex = lookup(self.meshLayer, 'vertex_snapper').nearest(point.x(), point.y(), searchradius)
 
-        if not self.tracer.isPointSnapped(vertexMapPosition):
+        if vertex < 0:
             return;
 
-        if self.firstVertex.isEmpty():
-            self.firstVertex = vertexMapPosition
+        if self.firstVertex < 0:
+            self.firstVertex = vertex
         else:
             if ctrl:  # Intermediate point
                 if len(self.profileTrace) == 0:
                     lastVertex = self.firstVertex
                 else:
                     lastVertex = self.profileTrace[-1]
-                traceResult= self.tracer.findShortestPath(lastVertex, vertexMapPosition)
-                if not traceResult[1]==QgsTracer.PathError.ErrNone:
+                newTrace = graph.shortest_path(lastVertex, vertex)
+                if newTrace is None:
                     self.updateMarker()
                     self.geometry_changed.emit()
                     return
-                newTrace=traceResult[0]
-                newTrace.pop(0)
+                if not len(self.profileTrace) == 0:  # the first vertex is already in the trace
+                    newTrace.pop(0)
                 self.profileTrace.extend(newTrace)
-                self.firstVertex = vertexMapPosition
+                self.firstVertex = vertex
                 self.temporaryTrace=[]
             else:
-                traceResult = self.tracer.findShortestPath(self.firstVertex, vertexMapPosition)
-                if not traceResult[1] == QgsTracer.PathError.ErrNone:
+                newTrace = graph.shortest_path(self.firstVertex, vertex)
+                if newTrace is None:
                     self.updateMarker()
                     self.geometry_changed.emit()
                     return
-                self.temporaryTrace=traceResult[0]
+                self.temporaryTrace = newTrace
                 if not len(self.profileTrace) == 0:  # If a trace exists before the temporary one,
                     self.temporaryTrace.pop(0)       # remove the first element to avoid duplicate vertex
 
@@ -171,45 +184,51 @@ class Profile1DPickerWidget(QToolButton):
         self.geometry_changed.emit()
 
     def initializeTracer(self, meshLayer):
-
+        """ only resets the picker, the network of the layer is built lazily by prepare_graph() """
+        self.cancel_graph_task()
         self.meshLayer=meshLayer
         self.profileTrace = []
-        self.newTrace = []
-
-        if meshLayer is None:
-            return
-
-        mesh = QgsMesh()
-
-        if meshLayer.dataProvider().contains(QgsMesh.ElementType.Edge):
-            meshLayer.dataProvider().populateMesh(mesh)
-
-        self.vectorLayer = QgsVectorLayer("linestringZ", "meshLayer", "memory")
-        self.vectorLayer.setCustomProperty("skipMemoryLayersCheck", 1)
-        self.vectorLayer.setCrs(meshLayer.crs())
-        self.vectorLayer.startEditing()
-
-        field = QgsField("EdgeIndex", QVariant.Int)
-        self.vectorLayer.addAttribute(field)
-
-        edgeCount = mesh.edgeCount()
-        for i in range(edgeCount):
-            f = QgsFeature()
-            edge = mesh.edge(i)
-            p1 = mesh.vertex(edge[0])
-            p2 = mesh.vertex(edge[1])
-            line = QgsLineString(p1, p2)
-            geometry = QgsGeometry(line)
-            f.setGeometry(geometry)
-            attrs = [i]
-            f.setAttributes(attrs)
-            self.vectorLayer.addFeature(f)
+        self.temporaryTrace = []
+        self.firstVertex = -1
 
-        self.vectorLayer.commitChanges()
+    def graph(self):
+        """ return EdgeGraph of the current layer or None if it is not prepared yet """
+        if self.meshLayer is None:
+            return None
+        return lookup(self.meshLayer, 'edge_graph')
 
-        layers = [self.vectorLayer]
-        self.tracer.setLayers(layers)
-        self.tracer.init()
+    def prepare_graph(self):
+        """ start building the network of the current layer in background if it is not cached,
+        return False when there is no network to build """
+        if self.meshLayer is None:
+            return False
+        if self.graph_task is not None or self.graph() is not None:
+            return True
+        edges = mesh_edges(self.meshLayer)
+        if edges is None:
+            return False
+
+        self.graph_task = EdgeGraphTask(self.meshLayer, edges)
+        self.graph_task.progressChanged.connect(self.on_graph_task_progress)
+        self.graph_task.taskCompleted.connect(partial(self.on_graph_task_finished, self.graph_task))
+        self.graph_task.taskTerminated.connect(partial(self.on_graph_task_finished, self.graph_task))
+        self.setText("Preparing network...")
+        QgsApplication.taskManager().addTask(self.graph_task)
+        return True
+
+    def cancel_graph_task(self):
+        if self.graph_task is not None:
+            self.graph_task.cancel()
+            self.on_graph_task_finished(self.graph_task)
+
+    def on_graph_task_progress(self, progress):
+        self.setText("Preparing network... {}%".format(int(progress)))
+
+    def on_graph_task_finished(self, task):
+        if task is not self.graph_task:
+            return
+        self.graph_task = None
+        self.setText(self.PICK_TEXT)
 
     def clear_marker(self):
         if self.firstVertexMarker is not None:
@@ -221,12 +240,13 @@ class Profile1DPickerWidget(QToolButton):
 
     def updateMarker(self):
         self.clear_marker()
-        if not self.firstVertex.isEmpty():
+        if self.firstVertex >= 0 and self.graph() is not None:
+            x, y = self.graph().vertices[self.firstVertex]
             self.firstVertexMarker = QgsVertexMarker(iface.mapCanvas())
             self.firstVertexMarker.setIconType(QgsVertexMarker.IconType.ICON_CIRCLE)
             self.firstVertexMarker.setPenWidth(2)
             self.firstVertexMarker.setFillColor(QColor(150, 150, 0, 150))
-            self.firstVertexMarker.setCenter(self.firstVertex)
+            self.firstVertexMarker.setCenter(QgsPointXY(x, y))
 
         trace=self.profile()
         if len(trace) > 1:
@@ -236,6 +256,15 @@ class Profile1DPickerWidget(QToolButton):
             self.profileHighlight.setColor(QColor(255, 165, 0, 170))
 
     def profile(self):
-        trace = self.profileTrace.copy()
-        trace.extend(self.temporaryTrace)
-        return trace
+        """ return list of points of the profile """
+        vertices = self.profile_vertices()
+        if vertices is None:
+            return []
+        return [QgsPointXY(x, y) for x, y in self.graph().vertices[vertices].tolist()]
+
+    def profile_vertices(self):
+        """ return array with indexes of mesh vertices of the profile points, None if there is no profile """
+        trace = self.profileTrace + self.temporaryTrace
+        if len(trace) == 0 or self.graph() is None:
+            return None
+        return np.array(trace, dtype=np.int64)
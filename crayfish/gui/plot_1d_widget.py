@@ -25,6 +25,9 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import math
+from functools import partial
+
+import numpy as np
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
@@ -40,14 +43,17 @@ try:
 except ImportError:
     import crayfish.pyqtgraph_0_13_7 as pyqtgraph
 
-from ..plot import timeseries_plot_data, cross_section_plot_data, colors, profile_1D_plot_data
+from ..plot import timeseries_plot_data_multi, colors, profile_1D_plot_data, PlotMesh
 from .utils import time_to_string
+from ..mesh_cache import dataset_times, mesh_edges
 from .plot_cf_layer_widget import CrayfishLayer1dWidget
 from .plot_1d_profile_widget import Profile1DPickerWidget
 from .plot_point_geometry_widget import PointGeometryPickerWidget
 from .plot_datasets_widget import DatasetsWidget
 from .plot_dataset_groups_widget import DatasetGroupsWidget
 from .plot_map_layer_widget import MapLayersWidget
+from .plot_worker import PlotDataWorker
+from .plot_items import PlotCurves, PlotVerticalLines, CanvasMarkers
 
 
 class Plot1dTypeMenu(QMenu):
@@ -149,10 +155,14 @@ class CrayfishPlot1dWidget(QWidget):
         self.btn_datasets = DatasetsWidget()
         self.btn_datasets.datasets_changed.connect(self.refresh_plot)
 
-        self.markers = []      # for points
+        self.markers = CanvasMarkers(iface.mapCanvas())      # for points
+
+        self.worker = PlotDataWorker(self)
 
         self.gw = pyqtgraph.GraphicsLayoutWidget()
         self.plot = self.gw.addPlot()
+        self.curves = PlotCurves(self.plot)
+        self.vertical_lines = PlotVerticalLines(self.plot)
         self.plot.showGrid(x=True, y=True)
         self.plot.addLegend()
 
@@ -216,6 +226,7 @@ class CrayfishPlot1dWidget(QWidget):
         if plot_type == PlotTypeWidget.PLOT_LONG_PROFILE:
             self.point_picker.clear_geometries()
             self.point_picker.stop_picking()
+            self.profile_picker.prepare_graph()
         elif plot_type == PlotTypeWidget.PLOT_TIME:
             # if self.btn_from_pt_layer.picked_layer is None:
             self.point_picker.start_picking_map()
@@ -258,6 +269,9 @@ class CrayfishPlot1dWidget(QWidget):
     def refresh_plot(self):
         plot_type = self.btn_plot_type.plot_type
 
+        # results of any pending computation are outdated now
+        self.worker.cancel()
+
         if self.layer is None:
             self.stack_layout.setCurrentWidget(self.label_no_layer)
             return
@@ -269,16 +283,15 @@ class CrayfishPlot1dWidget(QWidget):
 
         self.stack_layout.setCurrentWidget(self.gw)
 
-        self.clear_plot()
         if plot_type == PlotTypeWidget.PLOT_TIME:
             self.refresh_timeseries_plot()
         elif plot_type == PlotTypeWidget.PLOT_LONG_PROFILE:
             self.refresh_profile_plot()
 
     def clear_plot(self):
-        for m in self.markers:
-            iface.mapCanvas().scene().removeItem(m)
-        self.markers = []
+        self.markers.clear()
+        self.curves.clear()
+        self.vertical_lines.clear()
         self.plot.clear()
         self.clear_plot_legend()
 
@@ -294,78 +307,114 @@ class CrayfishPlot1dWidget(QWidget):
         self.plot.legend.updateSize()
 
     def refresh_timeseries_plot(self):
-        self.plot.getAxis('bottom').setLabel('Time [h]')
-        # re-add curves
-        for i, geometry in enumerate(self.point_picker.geometries):
-
-            clr = colors[ i % len(colors) ]
-            self.add_timeseries_plot(geometry, clr,self.point_picker.tool.searchRadiusMU(iface.mapCanvas()))
-
-            # add marker if the geometry is not temporary
-            if i != self.point_picker.temp_geometry_index:
-                marker = QgsVertexMarker(iface.mapCanvas())
-                marker.setColor(clr)
-                marker.setPenWidth(2)
-                marker.setCenter(geometry.asPoint())
-                self.markers.append(marker)
-
-    def add_timeseries_plot(self, geom_pt, clr,searchRadius):
-
+        layer = self.layer
         ds_group_index = self.current_dataset_group()
+        geometries = list(self.point_picker.geometries)
+        temp_geometry_index = self.point_picker.temp_geometry_index
 
-        x, y = timeseries_plot_data(self.layer, ds_group_index, geom_pt,searchRadius)
+        if len(geometries) == 0:
+            self.draw_timeseries_plot(ds_group_index, geometries, temp_geometry_index, None)
+            return
+
+        searchRadius = self.point_picker.tool.searchRadiusMU(iface.mapCanvas())
+        # the point under the mouse cursor is not worth keeping in the time series cache
+        persistent = [i for i in range(len(geometries)) if i != temp_geometry_index]
+        mesh = PlotMesh(layer, ds_group_index)
+        self.worker.submit(
+            lambda feedback: timeseries_plot_data_multi(layer, ds_group_index, geometries, searchRadius, feedback,
+                                                        persistent, mesh),
+            partial(self.draw_timeseries_plot, ds_group_index, geometries, temp_geometry_index),
+            self.clear_plot
+        )
+
+    def draw_timeseries_plot(self, ds_group_index, geometries, temp_geometry_index, data):
+        self.plot.getAxis('bottom').setLabel('Time [h]')
         self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
         self.plot.legend.setVisible(False)
 
-        valid_plot = not all(map(math.isnan, y))
-        if not valid_plot:
-            return
+        curves, markers = [], []
+        if data is not None:
+            x, y = data
+            for i, geometry in enumerate(geometries):
+                clr = colors[ i % len(colors) ]
+                if not np.all(np.isnan(y[i])):
+                    pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
+                    curves.append((('point', i), x, y[i], pen, None))
+
+                # add marker if the geometry is not temporary
+                if i != temp_geometry_index:
+                    markers.append((i, geometry.asPoint(), clr))
 
-        pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-        return self.plot.plot(x=x, y=y, connect='finite', pen=pen)
+        # existing curves and markers are only updated
+        self.curves.sync(curves)
+        self.markers.sync(markers)
+        self.vertical_lines.clear()
 
     def refresh_profile_plot(self):
-        self.plot.getAxis('bottom').setLabel('Distance [map unit]')
         profile = self.profile_picker.profile()
+        vertices = self.profile_picker.profile_vertices()
 
         if len(profile) < 2:
+            self.clear_plot()
+            self.plot.getAxis('bottom').setLabel('Distance [map unit]')
             return
 
+        layer = self.layer
         ds_group_index = self.current_dataset_group()
-        self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
         dataset_indexes = self.btn_datasets.datasets
         isCurrentDataset = len(dataset_indexes) == 0
         if isCurrentDataset:
             dataset_indexes = self.currentDatasetsForDatasetGroup()
 
-        self.plot.legend.setVisible(len(dataset_indexes) > 1)
+        edges = mesh_edges(layer) if vertices is not None else None
+
+        def compute(feedback):
+            curves = []
+            for i in dataset_indexes:
+                if feedback.isCanceled():
+                    break
+                x, y = profile_1D_plot_data(layer, ds_group_index, i, profile, vertices, edges)
+                curves.append((i, x, y))
+            return curves
+
+        self.worker.submit(compute, partial(self.draw_profile_plot, ds_group_index, profile, isCurrentDataset), self.clear_plot)
+
+    def draw_profile_plot(self, ds_group_index, profile, isCurrentDataset, curves):
+        self.plot.getAxis('bottom').setLabel('Distance [map unit]')
+        self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
+        self.plot.legend.setVisible(len(curves) > 1)
 
         #add vertical lines on vertices position
         s=0
         pen=pyqtgraph.mkPen(color=(200,100,0), style=Qt.PenStyle.DashDotLine)
+        lines = []
         if self.chckBox_verticalLine.isChecked():
             for i in range(len(profile) - 1):
                 p1 = profile[i]
                 p2 = profile[i + 1]
                 s = s+p1.distance(p2)
-                vertLine = self.plot.addLine(s)
-                vertLine.setPen(pen)
+                lines.append((i, s, pen))
+        self.vertical_lines.sync(lines)
 
-
-        for i in dataset_indexes:
-            x, y = profile_1D_plot_data(self.layer,ds_group_index, i, profile)
+        times = dataset_times(self.layer, ds_group_index)
+        entries = []
+        for i, x, y in curves:
 
             valid_plot = not all(map(math.isnan, y)) #is it necessary ? it will be good to tolerate nan
             if not valid_plot:
                 continue
 
             colorIndex = i
+            key = ('dataset', i)
             if isCurrentDataset:  # current dataset, used same color for all dataset for animation
                 colorIndex = 0
+                key = ('dataset', 'current')  # the same curve is updated while the time changes
             clr = colors[colorIndex % len(colors)]
             pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-            meta = self.layer.dataProvider().datasetMetadata(QgsMeshDatasetIndex(ds_group_index, i))
-            p = self.plot.plot(x=x, y=y, connect='finite', pen=pen, name=time_to_string(self.layer, meta.time()))
+            entries.append((key, x, y, pen, time_to_string(self.layer, times[i])))
+
+        self.curves.sync(entries)
+        self.markers.clear()
 
     def dataset_group_is_not_time_varying(self, dataset_group_index):
         if dataset_group_index is None:
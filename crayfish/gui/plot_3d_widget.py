@@ -25,6 +25,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import math
+from functools import partial
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
@@ -39,12 +40,61 @@ try:
 except ImportError:
     import crayfish.pyqtgraph_0_13_7 as pyqtgraph
 
-from ..plot import colors, plot_3d_data
+from ..plot import colors, plot_3d_data_multi, vertical_profile_curve, vertical_profile_time_data, PlotMesh
 from .utils import time_to_string
+from ..mesh_cache import dataset_times
 from .plot_cf_layer_widget import CrayfishLayer3dWidget
 from .plot_point_geometry_widget import PointGeometryPickerWidget
 from .plot_datasets_widget import DatasetsWidget
 from .plot_dataset_groups_widget import DatasetGroupsWidget
+from .plot_worker import PlotDataWorker
+from .plot_items import PlotCurves, PlotColumns, CanvasMarkers
+
+
+class Plot3dTypeMenu(QMenu):
+
+    plot_type_changed = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        QMenu.__init__(self, parent)
+
+        self.names = ["Vertical profile", "Vertical profile over time"]
+        for i, plot_type_name in enumerate(self.names):
+            a = self.addAction(plot_type_name)
+            a.plot_type = i
+            a.triggered.connect(self.on_action)
+
+    def on_action(self):
+        self.plot_type_changed.emit(self.sender().plot_type)
+
+
+class Plot3dTypeWidget(QToolButton):
+
+    plot_type_changed = pyqtSignal(int)
+
+    PLOT_PROFILE, PLOT_PROFILE_TIME = range(2)
+
+    def __init__(self, parent=None):
+        QToolButton.__init__(self, parent)
+
+        self.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextBesideIcon)
+        self.setIcon(QgsApplication.getThemeIcon("/histogram.png"))
+
+        self.menu_plot_types = Plot3dTypeMenu()
+
+        self.setPopupMode(QToolButton.ToolButtonPopupMode.InstantPopup)
+        self.setMenu(self.menu_plot_types)
+        self.menu_plot_types.plot_type_changed.connect(self.on_plot_type_changed)
+        self.set_plot_type(self.PLOT_PROFILE)
+
+    def set_plot_type(self, plot_type):
+        self.on_plot_type_changed(plot_type)
+
+    def on_plot_type_changed(self, plot_type):
+        self.plot_type = plot_type
+        self.setText("Plot: " + self.menu_plot_types.names[self.plot_type])
+        self.plot_type_changed.emit(plot_type)
+
 
 class CrayfishPlot3dWidget(QWidget):
 
@@ -56,6 +106,9 @@ class CrayfishPlot3dWidget(QWidget):
         self.btn_layer = CrayfishLayer3dWidget()
         self.btn_layer.layer_changed.connect(self.on_layer_changed)
 
+        self.btn_plot_type = Plot3dTypeWidget()
+        self.btn_plot_type.plot_type_changed.connect(self.on_plot_type_changed)
+
         self.btn_dataset_group = DatasetGroupsWidget(datasetType=QgsMeshDatasetGroupMetadata.DataType.DataOnVolumes)
         self.btn_dataset_group.dataset_groups_changed.connect(self.on_dataset_group_changed)
 
@@ -68,10 +121,14 @@ class CrayfishPlot3dWidget(QWidget):
         self.btn_datasets = DatasetsWidget()
         self.btn_datasets.datasets_changed.connect(self.on_datasets_changed)
 
-        self.markers = []  # for point
+        self.markers = CanvasMarkers(iface.mapCanvas())  # for point
+
+        self.worker = PlotDataWorker(self)
 
         self.gw = pyqtgraph.GraphicsLayoutWidget()
         self.plot = self.gw.addPlot()
+        self.curves = PlotCurves(self.plot)
+        self.columns = PlotColumns(self.plot)
         self.plot.showGrid(x=True, y=True)
         self.plot.addLegend()
 
@@ -84,6 +141,7 @@ class CrayfishPlot3dWidget(QWidget):
 
         hl = QHBoxLayout()
         hl.addWidget(self.btn_layer)
+        hl.addWidget(self.btn_plot_type)
         hl.addWidget(self.btn_dataset_group)
         hl.addWidget(self.btn_datasets)
         hl.addWidget(self.point_picker)
@@ -136,8 +194,14 @@ class CrayfishPlot3dWidget(QWidget):
 
         self.refresh_plot()
 
+    def on_plot_type_changed(self, plot_type):
+        # the depth vs. time plot shows all datasets of the group
+        self.btn_datasets.setVisible(plot_type == Plot3dTypeWidget.PLOT_PROFILE)
+        self.clear_plot()
+        self.refresh_plot()
+
     def on_canvas_time_range_changed(self):
-        if len(self.btn_datasets.datasets) == 0:
+        if self.btn_plot_type.plot_type == Plot3dTypeWidget.PLOT_PROFILE and len(self.btn_datasets.datasets) == 0:
             self.refresh_plot()
 
     def current_dataset(self):
@@ -171,64 +235,108 @@ class CrayfishPlot3dWidget(QWidget):
         self.refresh_plot()
 
     def refresh_plot(self):
+        # results of any pending computation are outdated now
+        self.worker.cancel()
+
         if self.layer is None:
             self.stack_layout.setCurrentWidget(self.label_no_layer)
             return
 
-        geoms = self.point_picker.geometries
+        geoms = list(self.point_picker.geometries)
         ds_group_index = self.current_dataset_group()
         ds_dataset_index = self.current_dataset()
         self.stack_layout.setCurrentWidget(self.gw)
-        self.clear_plot()
-        if geoms and ds_group_index is not None and ds_dataset_index is not None:
+        if self.btn_plot_type.plot_type == Plot3dTypeWidget.PLOT_PROFILE_TIME:
+            if geoms and ds_group_index is not None:
+                self.refresh_3d_time_plot(self.layer, ds_group_index, geoms)
+            else:
+                self.clear_plot()
+        elif geoms and ds_group_index is not None and ds_dataset_index is not None:
             self.refresh_3d_plot(self.layer, ds_group_index, ds_dataset_index, geoms)
+        else:
+            self.clear_plot()
 
     def clear_plot(self):
-        for m in self.markers:
-            iface.mapCanvas().scene().removeItem(m)
-        self.markers = []
+        self.markers.clear()
+        self.curves.clear()
+        self.columns.clear()
         self.plot.clear()
         self.clear_plot_legend()
         self.plot.setTitle("")
 
     def refresh_3d_plot(self, layer, ds_group_index, ds_dataset_index, geoms):
+        temp_geometry_index = self.point_picker.temp_geometry_index
+
+        mesh = PlotMesh(layer)
+
+        def compute(feedback):
+            data = plot_3d_data_multi(layer, ds_group_index, [ds_dataset_index], geoms, feedback, mesh)
+            if data is None:
+                return []
+            levels, values, averages = data
+            return [vertical_profile_curve(l, v, a) for l, v, a in zip(levels[0], values[0], averages[0])]
+
+        self.worker.submit(compute,
+                           partial(self.draw_3d_plot, ds_group_index, ds_dataset_index, geoms, temp_geometry_index),
+                           self.clear_plot)
+
+    def draw_3d_plot(self, ds_group_index, ds_dataset_index, geoms, temp_geometry_index, curves):
         self.plot.getAxis('bottom').setLabel('Magnitude')
         self.plot.getAxis('left').setLabel('Height')
-        self.plot.legend.setVisible(False)
 
-        # re-add curves
-        for i, geometry in enumerate(geoms):
+        entries, markers = [], []
+        for i, (geometry, (x, y, average)) in enumerate(zip(geoms, curves)):
 
             clr = colors[ i % len(colors) ]
-            self.add_3d_plot(layer, ds_group_index, ds_dataset_index, geometry, clr)
+            if not all(map(math.isnan, y)):
+                pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
+                name = None
+                if average is not None:
+                    name = '{0:.4f}'.format(average)
+                entries.append((i, x, y, pen, name))
 
             # add marker if the geometry is not temporary
-            if i != self.point_picker.temp_geometry_index:
-                marker = QgsVertexMarker(iface.mapCanvas())
-                marker.setColor(clr)
-                marker.setPenWidth(2)
-                marker.setCenter(geometry.asPoint())
-                self.markers.append(marker)
-
-        ds = QgsMeshDatasetIndex(ds_group_index, ds_dataset_index)
-        meta = self.layer.dataProvider().datasetMetadata(ds)
+            if i != temp_geometry_index:
+                markers.append((i, geometry.asPoint(), clr))
+
+        # existing curves and markers are only updated
+        self.curves.sync(entries)
+        self.markers.sync(markers)
+
+        time = dataset_times(self.layer, ds_group_index)[ds_dataset_index]
         grpmeta = self.layer.dataProvider().datasetGroupMetadata(ds_group_index)
-        name = grpmeta.name() + " @ " + time_to_string(self.layer, meta.time())
+        name = grpmeta.name() + " @ " + time_to_string(self.layer, time)
         self.plot.setTitle(name)
         self.plot.legend.setVisible(True)
 
-    def add_3d_plot(self, layer, ds_group_index, ds_dataset_index, geom_pt, clr):
-        x, y, average = plot_3d_data(layer, ds_group_index, ds_dataset_index, geom_pt)
+    def refresh_3d_time_plot(self, layer, ds_group_index, geoms):
+        # only the last picked (or hovered) point is shown
+        geometry = geoms[-1]
+        temp_geometry_index = self.point_picker.temp_geometry_index
+        persistent = [g for i, g in enumerate(geoms) if i != temp_geometry_index]
+
+        mesh = PlotMesh(layer)
 
-        valid_plot = not all(map(math.isnan, y))
-        if not valid_plot:
+        def compute(feedback):
+            return vertical_profile_time_data(layer, ds_group_index, geometry, feedback, mesh=mesh)
+
+        self.worker.submit(compute, partial(self.draw_3d_time_plot, ds_group_index, persistent), self.clear_plot)
+
+    def draw_3d_time_plot(self, ds_group_index, persistent, data):
+        if data is None or len(data[2]) == 0:
+            self.clear_plot()
             return
 
-        pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-        name = None
-        if average is not None:
-            name = '{0:.4f}'.format(average)
-        return self.plot.plot(x=x, y=y, name=name, connect='finite', pen=pen)
+        self.plot.getAxis('bottom').setLabel('Time [h]')
+        self.plot.getAxis('left').setLabel('Height')
+        self.plot.legend.setVisible(False)
+        self.curves.clear()
+
+        # one color mesh with all the datasets: time on x, volumes on y and value as color
+        xs, ys, zs = data
+        self.columns.set_data(xs, ys, zs, self.dataset_group_name(ds_group_index))
+        self.markers.sync([(i, geometry.asPoint(), colors[0]) for i, geometry in enumerate(persistent)])
+        self.plot.setTitle(self.dataset_group_name(ds_group_index))
 
     def dataset_group_name(self, group_index):
         if group_index is None or group_index < 0 or self.layer is None or self.layer.dataProvider() is None:
@@ -27,9 +27,9 @@
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtCore import *
-from qgis.core import QgsMeshDatasetIndex
 
 from .utils import time_to_string
+from ..mesh_cache import dataset_times
 
 class DatasetsMenu(QMenu):
 
@@ -74,9 +74,8 @@ class DatasetsMenu(QMenu):
         self.action_current.triggered.connect(self.on_action_current)
         self.addSeparator()
 
-        for i in range(self.layer.dataProvider().datasetCount(dataset_group_index)):
-            meta = self.layer.dataProvider().datasetMetadata(QgsMeshDatasetIndex(dataset_group_index, i))
-            a = self.addAction(time_to_string(self.layer, meta.time()))
+        for i, time in enumerate(dataset_times(self.layer, dataset_group_index)):
+            a = self.addAction(time_to_string(self.layer, time))
             a.dataset_index = i
             a.setCheckable(True)
             a.triggered.connect(self.on_action)
@@ -124,10 +123,8 @@ class DatasetsWidget(QToolButton):
         if len(lst) == 0:
             self.setText("Time: [current]")
         elif len(lst) == 1:
-            meta = self.menu_datasets.layer.dataProvider().datasetMetadata(
-                QgsMeshDatasetIndex(self.menu_datasets.dataset_group, lst[0])
-            )
-            self.setText("Time: " + time_to_string(self.menu_datasets.layer, meta.time()))
+            times = dataset_times(self.menu_datasets.layer, self.menu_datasets.dataset_group)
+            self.setText("Time: " + time_to_string(self.menu_datasets.layer, times[lst[0]]))
         else:
             self.setText("Time: [multiple]")
 
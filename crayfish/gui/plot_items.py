@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QRectF
+from qgis.core import QgsWkbTypes
+from qgis.gui import QgsVertexMarker, QgsRubberBand
+
+try:
+    import pyqtgraph
+except ImportError:
+    import crayfish.pyqtgraph_0_13_7 as pyqtgraph
+
+
+class KeyedItems:
+    """ items identified by keys that are updated in place on each sync()
+
+    Only items with keys that were not there before are created
+    and only items with keys that are gone are removed """
+
+    def __init__(self):
+        self.items = {}
+
+    def sync(self, entries):
+        """ entries is a list of (key, *args) tuples describing the wanted state """
+        wanted = set()
+        for key, *args in entries:
+            wanted.add(key)
+            item = self.items.get(key)
+            if item is not None:
+                item = self.update_item(item, *args)
+            if item is None:
+                item = self.create_item(*args)
+            self.items[key] = item
+
+        for key in list(self.items.keys()):
+            if key not in wanted:
+                self.remove_item(self.items.pop(key))
+
+    def clear(self):
+        for item in self.items.values():
+            self.remove_item(item)
+        self.items = {}
+
+    def create_item(self, *args):
+        raise NotImplementedError
+
+    def update_item(self, item, *args):
+        """ update the item and return it, or return None if it needs to be recreated """
+        raise NotImplementedError
+
+    def remove_item(self, item):
+        raise NotImplementedError
+
+
+class PlotCurves(KeyedItems):
+    """ curves of a pyqtgraph plot, entries are (key, x, y, pen, name) """
+
+    def __init__(self, plot):
+        KeyedItems.__init__(self)
+        self.plot = plot
+
+    def create_item(self, x, y, pen, name):
+        return self.plot.plot(x=x, y=y, connect='finite', pen=pen, name=name)
+
+    def update_item(self, item, x, y, pen, name):
+        if (name is None) != (item.name() is None):
+            # legend entries are only created together with the curve
+            self.remove_item(item)
+            return None
+
+        item.setData(x=x, y=y)
+        if item.opts['pen'] != pen:
+            item.setPen(pen)
+        if name is not None and name != item.name():
+            item.opts['name'] = name
+            label = self.plot.legend.getLabel(item)
+            if label is not None:
+                label.setText(name)
+        return item
+
+    def remove_item(self, item):
+        self.plot.removeItem(item)
+
+
+class PlotVerticalLines(KeyedItems):
+    """ infinite vertical lines of a pyqtgraph plot, entries are (key, x, pen) """
+
+    def __init__(self, plot):
+        KeyedItems.__init__(self)
+        self.plot = plot
+
+    def create_item(self, x, pen):
+        return self.plot.addLine(x=x, pen=pen)
+
+    def update_item(self, line, x, pen):
+        line.setValue(x)
+        line.setPen(pen)
+        return line
+
+    def remove_item(self, line):
+        self.plot.removeItem(line)
+
+
+class PlotColorMap:
+    """ base for an item showing values as colors with a color bar in a pyqtgraph plot
+
+    Items are only created when the data are shown for the first time """
+
+    def __init__(self, plot):
+        self.plot = plot
+        self.item = None
+        self.colorbar = None
+
+    def create_item(self):
+        raise NotImplementedError
+
+    def show_levels(self, values, label):
+        """ create the items if needed and return (min, max) of finite values """
+        if self.item is None:
+            self.item = self.create_item()
+            self.plot.addItem(self.item)
+            self.colorbar = pyqtgraph.ColorBarItem(colorMap=pyqtgraph.colormap.get('viridis'))
+            self.colorbar.setImageItem(self.item, insert_in=self.plot)
+
+        finite = values[np.isfinite(values)]
+        levels = (finite.min(), finite.max()) if len(finite) else (0., 1.)
+        self.colorbar.setLevels(levels)
+        self.colorbar.axis.setLabel(label)
+        return levels
+
+    def clear(self):
+        if self.item is None:
+            return
+        self.plot.removeItem(self.item)
+        self.plot.layout.removeItem(self.colorbar)
+        if self.colorbar.scene() is not None:
+            self.colorbar.scene().removeItem(self.colorbar)
+        self.item = None
+        self.colorbar = None
+
+
+class PlotImage(PlotColorMap):
+    """ image of a regular grid of values with a color bar in a pyqtgraph plot """
+
+    def create_item(self):
+        image = pyqtgraph.ImageItem(axisOrder='row-major')
+        image.setAutoDownsample(True)
+        return image
+
+    def set_data(self, x, y, values, label):
+        """ show (y x x) values of a grid with regularly spaced coordinates x and y """
+        levels = self.show_levels(values, label)
+        self.item.setImage(values, autoLevels=False, levels=levels)
+
+        # pixel centers are at the grid coordinates
+        dx = (x[-1] - x[0]) / max(len(x) - 1, 1)
+        dy = (y[-1] - y[0]) / max(len(y) - 1, 1)
+        self.item.setRect(QRectF(x[0] - dx / 2, y[0] - dy / 2, dx * len(x), dy * len(y)))
+
+
+class PlotColumns(PlotColorMap):
+    """ columns of cells with non-uniform vertical boundaries (e.g. volumes of 3D mesh over time)
+    drawn as a color mesh with a color bar in a pyqtgraph plot """
+
+    def create_item(self):
+        return pyqtgraph.PColorMeshItem()
+
+    def set_data(self, xs, ys, zs, label):
+        """ show color mesh with corners xs, ys and cell values zs (see utils.column_mesh) """
+        zs = np.asarray(zs, dtype=float)
+        self.show_levels(zs, label)
+        # color levels are already set by the color bar
+        self.item.setData(xs, ys, zs, autoLevels=False)
+
+
+class CanvasMarkers(KeyedItems):
+    """ vertex markers in map canvas, entries are (key, point, color) """
+
+    def __init__(self, canvas):
+        KeyedItems.__init__(self)
+        self.canvas = canvas
+
+    def create_item(self, point, color):
+        marker = QgsVertexMarker(self.canvas)
+        marker.setPenWidth(2)
+        return self.update_item(marker, point, color)
+
+    def update_item(self, marker, point, color):
+        marker.setColor(color)
+        marker.setCenter(point)
+        return marker
+
+    def remove_item(self, marker):
+        self.canvas.scene().removeItem(marker)
+
+
+class CanvasRubberBands(KeyedItems):
+    """ rubber bands in map canvas, entries are (key, geometry, color) """
+
+    def __init__(self, canvas):
+        KeyedItems.__init__(self)
+        self.canvas = canvas
+
+    def create_item(self, geometry, color):
+        rb = QgsRubberBand(self.canvas, QgsWkbTypes.GeometryType.PointGeometry)
+        rb.setWidth(2)
+        return self.update_item(rb, geometry, color)
+
+    def update_item(self, rb, geometry, color):
+        rb.setColor(color)
+        rb.setToGeometry(geometry, None)
+        return rb
+
+    def remove_item(self, rb):
+        self.canvas.scene().removeItem(rb)
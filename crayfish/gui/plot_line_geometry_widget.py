@@ -35,6 +35,7 @@ from qgis.gui import *
 from qgis.utils import iface
 
 from .plot_map_layer_widget import MapLayersWidget
+from .utils import HoverThrottle
 
 
 class PickGeometryTool(QgsMapTool):
@@ -45,27 +46,34 @@ class PickGeometryTool(QgsMapTool):
         QgsMapTool.__init__(self, canvas)
         self.points = []
         self.capturing = False
+        # mouse moves come much faster than plots can be updated, only the last one matters
+        self.hover = HoverThrottle(lambda pt: self.picked.emit(self.points + [pt], False), parent=self)
 
     def canvasMoveEvent(self, e):
 
         if not self.capturing:
             return
 
-        self.picked.emit(self.points + [e.mapPoint()], False)
+        self.hover.request(e.mapPoint())
 
     def canvasPressEvent(self, e):
+        self.hover.discard()
         if e.button() == Qt.MouseButton.LeftButton:
             self.capturing = True
             self.points.append(e.mapPoint())
             self.picked.emit(self.points, False)
         if e.button() == Qt.MouseButton.RightButton:
-            self.picked.emit(self.points, True)
+            points, self.points = self.points, []
             self.capturing = False
-            self.points = []
+            self.picked.emit(points, True)
 
     def canvasReleaseEvent(self, e):
         pass
 
+    def deactivate(self):
+        self.hover.discard()
+        QgsMapTool.deactivate(self)
+
 
 class LineGeometryPickerWidget(QWidget):
 
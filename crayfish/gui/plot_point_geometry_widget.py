@@ -32,6 +32,8 @@ from qgis.core import *
 from qgis.gui import *
 from qgis.utils import iface
 
+from .utils import HoverThrottle
+
 
 class PickGeometryTool(QgsMapTool):
 
@@ -39,18 +41,25 @@ class PickGeometryTool(QgsMapTool):
 
     def __init__(self, canvas):
         QgsMapTool.__init__(self, canvas)
+        # mouse moves come much faster than plots can be updated, only the last one matters
+        self.hover = HoverThrottle(lambda pt: self.picked.emit(pt, False, False), parent=self)
 
     def canvasMoveEvent(self, e):
         #if e.button() == Qt.LeftButton:
-        self.picked.emit(e.mapPoint(), False, False)
+        self.hover.request(e.mapPoint())
 
     def canvasPressEvent(self, e):
         if e.button() == Qt.MouseButton.LeftButton:
+            self.hover.discard()
             self.picked.emit(e.mapPoint(), True, bool(e.modifiers() & Qt.KeyboardModifier.ControlModifier))
 
     def canvasReleaseEvent(self, e):
         pass
 
+    def deactivate(self):
+        self.hover.discard()
+        QgsMapTool.deactivate(self)
+
 
 class PointGeometryPickerWidget(QWidget):
 
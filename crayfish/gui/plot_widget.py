@@ -24,7 +24,9 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import math
+from functools import partial
+
+import numpy as np
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
@@ -39,14 +41,69 @@ try:
 except ImportError:
     import crayfish.pyqtgraph_0_13_7 as pyqtgraph
 
-from ..plot import timeseries_plot_data, cross_section_plot_data, colors, integral_plot_data
+from ..plot import timeseries_plot_data_multi, cross_section_plot_data_multi, cross_section_time_plot_data, colors, \
+    integral_plot_data, timeseries_store_enabled, set_timeseries_store_enabled, timeseries_store_size, \
+    clear_timeseries_store, PlotMesh
 from .utils import time_to_string
+from ..mesh_cache import dataset_times
 from .plot_cf_layer_widget import CrayfishLayer2dWidget
 from .plot_line_geometry_widget import LineGeometryPickerWidget
 from .plot_point_geometry_widget import PointGeometryPickerWidget
 from .plot_datasets_widget import DatasetsWidget
 from .plot_dataset_groups_widget import DatasetGroupsWidget
 from .plot_map_layer_widget import MapLayersWidget
+from .plot_worker import PlotDataWorker
+from .plot_items import PlotCurves, PlotImage, CanvasMarkers, CanvasRubberBands
+
+class PlotOptionsDialog(QDialog):
+    """ options of plots: cross-section resolution and the on-disk cache of time series """
+
+    def __init__(self, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle('Plot Options')
+        s = QSettings()
+
+        self.spin_resolution = QDoubleSpinBox()
+        self.spin_resolution.setDecimals(6)
+        self.spin_resolution.setRange(0.000001, 1000000)
+        self.spin_resolution.setValue(s.value('/crayfish/cross_section_resolution', 1., type=float))
+
+        self.chk_cache = QCheckBox('Keep computed time series in a cache on disk')
+        self.chk_cache.setChecked(timeseries_store_enabled())
+
+        self.label_cache_size = QLabel()
+        self.btn_clear_cache = QPushButton('Clear cache')
+        self.btn_clear_cache.clicked.connect(self.on_clear_cache_clicked)
+        self.update_cache_size()
+
+        hl = QHBoxLayout()
+        hl.addWidget(self.label_cache_size)
+        hl.addStretch()
+        hl.addWidget(self.btn_clear_cache)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QFormLayout(self)
+        layout.addRow('Cross-section plot resolution [map units]', self.spin_resolution)
+        layout.addRow(self.chk_cache)
+        layout.addRow(hl)
+        layout.addRow(buttons)
+
+    def update_cache_size(self):
+        size = timeseries_store_size()
+        self.label_cache_size.setText('Cache size: {:.1f} MB'.format(size / 1024. / 1024.))
+        self.btn_clear_cache.setEnabled(size > 0)
+
+    def on_clear_cache_clicked(self):
+        clear_timeseries_store()
+        self.update_cache_size()
+
+    def save(self):
+        QSettings().setValue('/crayfish/cross_section_resolution', self.spin_resolution.value())
+        set_timeseries_store_enabled(self.chk_cache.isChecked())
+
 
 class PlotTypeMenu(QMenu):
 
@@ -55,7 +112,7 @@ class PlotTypeMenu(QMenu):
     def __init__(self, parent=None):
         QMenu.__init__(self, parent)
 
-        self.names = ["Time series", "Cross-section"]
+        self.names = ["Time series", "Cross-section", "Cross-section over time"]
         for i, plot_type_name in enumerate(self.names):
             a = self.addAction(plot_type_name)
             a.plot_type = i
@@ -69,7 +126,7 @@ class PlotTypeWidget(QToolButton):
 
     plot_type_changed = pyqtSignal(int)
 
-    PLOT_TIME, PLOT_CROSS_SECTION = range(2)
+    PLOT_TIME, PLOT_CROSS_SECTION, PLOT_CROSS_SECTION_TIME = range(3)
 
     def __init__(self, parent=None):
         QToolButton.__init__(self, parent)
@@ -180,11 +237,15 @@ class CrayfishPlotWidget(QWidget):
         self.btn_options.setIcon(QgsApplication.getThemeIcon( "/mActionOptions.svg" ))
         self.btn_options.clicked.connect(self.on_options_clicked)
 
-        self.markers = []      # for points
-        self.rubberbands = []  # for lines
+        self.markers = CanvasMarkers(iface.mapCanvas())          # for points
+        self.rubberbands = CanvasRubberBands(iface.mapCanvas())  # for lines
+
+        self.worker = PlotDataWorker(self)
 
         self.gw = pyqtgraph.GraphicsLayoutWidget()
         self.plot = self.gw.addPlot()
+        self.curves = PlotCurves(self.plot)
+        self.image = PlotImage(self.plot)
         self.plot.showGrid(x=True, y=True)
         self.plot.addLegend()
 
@@ -239,11 +300,15 @@ class CrayfishPlotWidget(QWidget):
         self.reset_widget()
 
     def on_plot_type_changed(self, plot_type):
-        self.line_picker.setVisible(plot_type == PlotTypeWidget.PLOT_CROSS_SECTION)
+        is_cross_section = plot_type in (PlotTypeWidget.PLOT_CROSS_SECTION, PlotTypeWidget.PLOT_CROSS_SECTION_TIME)
+        self.line_picker.setVisible(is_cross_section)
         self.btn_datasets.setVisible(plot_type == PlotTypeWidget.PLOT_CROSS_SECTION)
         self.btn_geom_type.setVisible(plot_type == PlotTypeWidget.PLOT_TIME)
         self.btn_from_pt_layer.setVisible(plot_type == PlotTypeWidget.PLOT_TIME)
-        self.btn_from_line_layer.setVisible(plot_type == PlotTypeWidget.PLOT_CROSS_SECTION)
+        self.btn_from_line_layer.setVisible(is_cross_section)
+
+        # curves and the image are not shared between plot types
+        self.clear_plot()
 
         if plot_type != PlotTypeWidget.PLOT_TIME:
             self.point_picker.clear_geometries()
@@ -270,7 +335,8 @@ class CrayfishPlotWidget(QWidget):
 
     def on_dataset_group_changed(self, lst):
         if len(lst) == 0:
-            self.btn_datasets.set_dataset_group(self.layer.rendererSettings().activeScalarDatasetGroup() if self.layer is not None else None)
+            self.btn_datasets.set_dataset_group(
+                self.layer.rendererSettings().activeScalarDatasetGroup() if self.layer is not None else None)
         elif len(lst) == 1:
             self.btn_datasets.set_dataset_group(lst[0])
 
@@ -291,6 +357,8 @@ class CrayfishPlotWidget(QWidget):
         self.refresh_plot()
 
     def on_canvas_time_range_changed(self):
+        if self.btn_plot_type.plot_type == PlotTypeWidget.PLOT_CROSS_SECTION_TIME:
+            return  # shows all the times already
         if len(self.btn_datasets.datasets) == 0:
             self.refresh_plot()
 
@@ -305,18 +373,21 @@ class CrayfishPlotWidget(QWidget):
         plot_type = self.btn_plot_type.plot_type
         geom_type = self.btn_geom_type.geometry_type
 
+        # results of any pending computation are outdated now
+        self.worker.cancel()
+
         if self.layer is None:
             self.stack_layout.setCurrentWidget(self.label_no_layer)
             return
 
         ds = self.current_dataset_group()
-        if plot_type == PlotTypeWidget.PLOT_TIME and self.dataset_group_is_not_time_varying(ds):
+        if plot_type in (PlotTypeWidget.PLOT_TIME, PlotTypeWidget.PLOT_CROSS_SECTION_TIME) and \
+                self.dataset_group_is_not_time_varying(ds):
             self.stack_layout.setCurrentWidget(self.label_not_time_varying)
             return
 
         self.stack_layout.setCurrentWidget(self.gw)
 
-        self.clear_plot()
         if plot_type == PlotTypeWidget.PLOT_TIME:
             if geom_type == GeometryTypeWidget.POINT:
                 self.refresh_timeseries_plot()
@@ -326,14 +397,14 @@ class CrayfishPlotWidget(QWidget):
                 pass
         elif plot_type == PlotTypeWidget.PLOT_CROSS_SECTION:
             self.refresh_cross_section_plot()
+        elif plot_type == PlotTypeWidget.PLOT_CROSS_SECTION_TIME:
+            self.refresh_cross_section_time_plot()
 
     def clear_plot(self):
-        for m in self.markers:
-            iface.mapCanvas().scene().removeItem(m)
-        self.markers = []
-        for rb in self.rubberbands:
-            iface.mapCanvas().scene().removeItem(rb)
-        self.rubberbands = []
+        self.markers.clear()
+        self.rubberbands.clear()
+        self.curves.clear()
+        self.image.clear()
         self.plot.clear()
         self.clear_plot_legend()
 
@@ -349,92 +420,197 @@ class CrayfishPlotWidget(QWidget):
         self.plot.legend.updateSize()
 
     def refresh_timeseries_plot(self):
-        self.plot.getAxis('bottom').setLabel('Time [h]')
-        # re-add curves
-        for i, geometry in enumerate(self.point_picker.geometries):
-
-            clr = colors[ i % len(colors) ]
-            self.add_timeseries_plot(geometry, clr)
+        layer = self.layer
+        ds_group_index = self.current_dataset_group()
+        geometries = list(self.point_picker.geometries)
+        temp_geometry_index = self.point_picker.temp_geometry_index
 
-            # add marker if the geometry is not temporary
-            if i != self.point_picker.temp_geometry_index:
-                marker = QgsVertexMarker(iface.mapCanvas())
-                marker.setColor(clr)
-                marker.setPenWidth(2)
-                marker.setCenter(geometry.asPoint())
-                self.markers.append(marker)
+        if len(geometries) == 0:
+            self.draw_timeseries_plot(ds_group_index, geometries, temp_geometry_index, None)
+            return
 
-    def add_timeseries_plot(self, geom_pt, clr):
+        # the point under the mouse cursor is not worth keeping in the time series cache
+        persistent = [i for i in range(len(geometries)) if i != temp_geometry_index]
 
-        ds_group_index = self.current_dataset_group()
+        # all the points are extracted at once, in background
+        mesh = PlotMesh(layer, ds_group_index)
+        self.worker.submit(
+            lambda feedback: timeseries_plot_data_multi(layer, ds_group_index, geometries,
+                                                        feedback=feedback, persistent=persistent, mesh=mesh),
+            partial(self.draw_timeseries_plot, ds_group_index, geometries, temp_geometry_index),
+            self.clear_plot
+        )
 
-        x, y = timeseries_plot_data(self.layer, ds_group_index, geom_pt)
+    def draw_timeseries_plot(self, ds_group_index, geometries, temp_geometry_index, data):
+        self.plot.getAxis('bottom').setLabel('Time [h]')
         self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
         self.plot.legend.setVisible(False)
 
-        pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-        return self.plot.plot(x=x, y=y, connect='finite', pen=pen)
+        curves, markers = [], []
+        if data is not None:
+            x, y = data
+            for i, geometry in enumerate(geometries):
+                clr = colors[ i % len(colors) ]
+                pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
+                curves.append((('point', i), x, y[i], pen, None))
 
-    def refresh_cross_section_plot(self):
-        self.plot.getAxis('bottom').setLabel('Station [m]')
+                # add marker if the geometry is not temporary
+                if i != temp_geometry_index:
+                    markers.append((i, geometry.asPoint(), clr))
 
-        if len(self.line_picker.geometries) == 0:
-            return
+        # existing curves and markers are only updated
+        self.curves.sync(curves)
+        self.markers.sync(markers)
+        self.rubberbands.clear()
 
-        geometry = self.line_picker.geometries[0]  # only using the first linestring
+    def refresh_cross_section_plot(self):
+        # only using the first linestring
+        geometry = self.line_picker.geometries[0] if len(self.line_picker.geometries) else None
 
-        if len(geometry.asPolyline()) == 0:
-            return  # not a linestring?
+        if geometry is None or len(geometry.asPolyline()) == 0:  # not a linestring?
+            self.clear_plot()
+            self.plot.getAxis('bottom').setLabel('Station [m]')
+            return
 
+        layer = self.layer
         ds_group_index = self.current_dataset_group()
 
-        self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
-
-        dataset_indexes = self.btn_datasets.datasets
+        dataset_indexes = list(self.btn_datasets.datasets)
         isCurrentDataset = len(dataset_indexes) == 0
         if isCurrentDataset:
             dataset_indexes = self.currentDatasetsForDatasetGroup()
 
-        self.plot.legend.setVisible(len(dataset_indexes) > 1)
-
         s = QSettings()
         plot_resolution = s.value('/crayfish/cross_section_resolution', 1., type=float)
 
-        for i in dataset_indexes:
-            x,y = cross_section_plot_data(self.layer, ds_group_index, i, geometry, plot_resolution)
+        # all the datasets are sampled at once, in background
+        mesh = PlotMesh(layer)
+        self.worker.submit(
+            lambda feedback: cross_section_plot_data_multi(layer, ds_group_index, dataset_indexes, geometry,
+                                                           plot_resolution, feedback, mesh),
+            partial(self.draw_cross_section_plot, ds_group_index, geometry, isCurrentDataset, dataset_indexes),
+            self.clear_plot
+        )
+
+    def draw_cross_section_plot(self, ds_group_index, geometry, isCurrentDataset, dataset_indexes, data):
+        self.plot.getAxis('bottom').setLabel('Station [m]')
+        self.plot.getAxis('left').setLabel(self.dataset_group_name(ds_group_index))
+
+        x, y = data
+        valid = ~np.all(np.isnan(y), axis=1)
+
+        if len(dataset_indexes) > len(colors):
+            # colors (and so legend entries) would repeat anyway, so rows with the same color
+            # are drawn as one multi-line item to keep plotting of many datasets fast
+            self.plot.legend.setVisible(False)
+            self.curves.sync(self.multi_line_curves(x, y, np.asarray(dataset_indexes), valid))
+            self.markers.clear()
+            self.rubberbands.sync([('line', geometry, colors[0])])
+            return
 
-            valid_plot = not all(map(math.isnan, y))
+        self.plot.legend.setVisible(len(dataset_indexes) > 1)
+
+        times = dataset_times(self.layer, ds_group_index)
+        entries = []
+        for row, i in enumerate(dataset_indexes):
+
+            valid_plot = valid[row]
             if not valid_plot:
                 continue
 
             colorIndex = i
+            key = ('dataset', i)
             if isCurrentDataset : #current dataset, used same color for all dataset for animation
                 colorIndex = 0
+                key = ('dataset', 'current')  # the same curve is updated while the time changes
             clr = colors[colorIndex % len(colors)]
             pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-            meta = self.layer.dataProvider().datasetMetadata(QgsMeshDatasetIndex(ds_group_index, i))
-            p = self.plot.plot(x=x, y=y, connect='finite', pen=pen, name=time_to_string(self.layer, meta.time()))
-
-        rb = QgsRubberBand(iface.mapCanvas(), QgsWkbTypes.GeometryType.PointGeometry)
-        rb.setColor(colors[0])
-        rb.setWidth(2)
-        rb.setToGeometry(geometry, None)
-        self.rubberbands.append(rb)
+            entries.append((key, x, y[row], pen, time_to_string(self.layer, times[i])))
+
+        self.curves.sync(entries)
+        self.markers.clear()
+        self.rubberbands.sync([('line', geometry, colors[0])])
+
+    def multi_line_curves(self, x, y, dataset_indexes, valid):
+        """ return curve entries with rows of y of the same color joined
+        into a single line broken by NaN values """
+        entries = []
+        for colorIndex, clr in enumerate(colors):
+            rows = np.flatnonzero(valid & (dataset_indexes % len(colors) == colorIndex))
+            if len(rows) == 0:
+                continue
+            separator = np.full((len(rows), 1), np.nan)
+            xs = np.hstack((np.broadcast_to(x, (len(rows), len(x))), separator)).ravel()
+            ys = np.hstack((y[rows], separator)).ravel()
+            pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
+            entries.append((('datasets', colorIndex), xs, ys, pen, None))
+        return entries
 
-    def refresh_integral_plot(self):
-        self.plot.getAxis('bottom').setLabel('Time [h]')
+    def refresh_cross_section_time_plot(self):
+        # only using the first linestring
+        geometry = self.line_picker.geometries[0] if len(self.line_picker.geometries) else None
 
-        if len(self.line_picker.geometries) == 0:
+        if geometry is None or len(geometry.asPolyline()) == 0:  # not a linestring?
+            self.clear_plot()
+            self.plot.getAxis('bottom').setLabel('Station [m]')
             return
 
+        layer = self.layer
+        ds_group_index = self.current_dataset_group()
+
+        s = QSettings()
+        plot_resolution = s.value('/crayfish/cross_section_resolution', 1., type=float)
+
+        mesh = PlotMesh(layer)
+        self.worker.submit(
+            lambda feedback: cross_section_time_plot_data(layer, ds_group_index, geometry, plot_resolution, feedback,
+                                                          mesh=mesh),
+            partial(self.draw_cross_section_time_plot, ds_group_index, geometry),
+            self.clear_plot
+        )
+
+    def draw_cross_section_time_plot(self, ds_group_index, geometry, data):
+        self.plot.getAxis('bottom').setLabel('Station [m]')
+        self.plot.getAxis('left').setLabel('Time [h]')
+        self.plot.legend.setVisible(False)
+
+        # one image with all the datasets: station on x, time on y and value as color
+        x, times, values = data
+        self.image.set_data(x, times, values, self.dataset_group_name(ds_group_index))
+        self.markers.clear()
+        self.rubberbands.sync([('line', geometry, colors[0])])
+
+    def refresh_integral_plot(self):
         # this can be extended for more features
-        geometry = self.line_picker.geometries[0]  # only using the first linestring
+        # only using the first linestring
+        geometry = self.line_picker.geometries[0] if len(self.line_picker.geometries) else None
 
-        if len(geometry.asPolyline()) == 0:
-            return  # not a linestring?
+        if geometry is None or len(geometry.asPolyline()) == 0:  # not a linestring?
+            self.clear_plot()
+            self.plot.getAxis('bottom').setLabel('Time [h]')
+            return
 
+        layer = self.layer
         ds_group_index = self.current_dataset_group()
 
+        s = QSettings()
+        plot_resolution = s.value('/crayfish/cross_section_resolution', 1., type=float)
+
+        # do not keep integrals of lines still being drawn in the cache
+        persistent = not self.line_picker.tool.capturing
+
+        mesh = PlotMesh(layer, ds_group_index)
+        self.worker.submit(
+            lambda feedback: integral_plot_data(layer, ds_group_index, geometry, plot_resolution, feedback, persistent,
+                                                mesh),
+            partial(self.draw_integral_plot, ds_group_index, geometry),
+            self.clear_plot
+        )
+
+    def draw_integral_plot(self, ds_group_index, geometry, data):
+        self.plot.getAxis('bottom').setLabel('Time [h]')
+        self.plot.legend.setVisible(False)
+
         split = self.dataset_group_name(ds_group_index).split('[')
         variable = split[0]
         try:
@@ -443,31 +619,20 @@ class CrayfishPlotWidget(QWidget):
         except IndexError:
             self.plot.getAxis('left').setLabel('Integral of {} [m]'.format(variable))
 
-        s = QSettings()
-        plot_resolution = s.value('/crayfish/cross_section_resolution', 1., type=float)
-
-        x, y = integral_plot_data(self.layer, ds_group_index, geometry, plot_resolution)
+        x, y = data
 
         clr = colors[0 % len(colors)]
         pen = pyqtgraph.mkPen(color=clr, width=2, cosmetic=True)
-        p = self.plot.plot(x=x, y=y, connect='finite', pen=pen)
-
-        rb = QgsRubberBand(iface.mapCanvas(), QgsWkbTypes.GeometryType.PointGeometry)
-        rb.setColor(colors[0])
-        rb.setWidth(2)
-        rb.setToGeometry(geometry, None)
-        self.rubberbands.append(rb)
+        self.curves.sync([('integral', x, y, pen, None)])
+        self.markers.clear()
+        self.rubberbands.sync([('line', geometry, colors[0])])
 
     def on_options_clicked(self):
-        s = QSettings()
-        value = s.value('/crayfish/cross_section_resolution', 1., type=float)
-
-        value, res = QInputDialog.getDouble(None, 'Plot Options', 'Cross-section plot resolution [map units]',
-                                            value, 0.000001, 1000000, 6)
-        if not res:
+        dlg = PlotOptionsDialog(self)
+        if not dlg.exec():
             return
 
-        s.setValue('/crayfish/cross_section_resolution', value)
+        dlg.save()
 
         self.refresh_plot()
 
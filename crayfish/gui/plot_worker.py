@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import traceback
+
+from qgis.PyQt.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from qgis.core import QgsFeedback, QgsMessageLog, Qgis
+
+
+class _TaskSignals(QObject):
+
+    finished = pyqtSignal(int, object)   # request id, result
+
+
+class _PlotDataTask(QRunnable):
+
+    def __init__(self, request_id, fn, feedback):
+        QRunnable.__init__(self)
+        self.request_id = request_id
+        self.fn = fn
+        self.feedback = feedback
+        self.signals = _TaskSignals()
+
+    def run(self):
+        result = None
+        if not self.feedback.isCanceled():  # may be already outdated when started
+            try:
+                result = self.fn(self.feedback)
+            except Exception:
+                QgsMessageLog.logMessage(traceback.format_exc(), "Crayfish", Qgis.MessageLevel.Critical)
+
+        self.signals.finished.emit(self.request_id, result)
+
+
+_pool = None
+
+
+def _shared_pool():
+    """ return the thread pool with a single thread shared by workers of all plots """
+    global _pool
+    if _pool is None:
+        _pool = QThreadPool()
+        _pool.setMaxThreadCount(1)
+    return _pool
+
+
+class PlotDataWorker(QObject):
+    """ computes plot data outside of the GUI thread
+
+    Every new request cancels the previous one, so only the result of the most
+    recent request is delivered to its callback (in the GUI thread).
+    Requests of all workers run one by one in a single shared thread, so plots do
+    not read data providers at once with each other. The GUI thread still reads
+    them meanwhile (e.g. dataset metadata), and objects shared through mesh_cache
+    must be safe to use from both threads.
+
+    The layer's triangular mesh must not be touched by fn: mesh objects are prepared
+    in the GUI thread before submit() (see plot.PlotMesh) and fn only reads datasets """
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.pool = _shared_pool()
+        self.request_id = 0
+        self.feedback = None
+        self.callback = None
+        self.failed = None
+        self.tasks = {}
+
+    def submit(self, fn, callback, failed=None):
+        """ run fn(feedback) in background and then callback(result) in GUI thread
+
+        When fn raises an exception or returns None, failed() is called instead
+        (if given), e.g. to clear results of previous requests """
+        self.cancel()
+        self.request_id += 1
+        self.feedback = QgsFeedback()
+        self.callback = callback
+        self.failed = failed
+
+        task = _PlotDataTask(self.request_id, fn, self.feedback)
+        task.signals.finished.connect(self.on_task_finished)
+        self.tasks[self.request_id] = task
+        self.pool.start(task)
+
+    def cancel(self):
+        """ cancel running request, its callback will not be called """
+        if self.feedback is not None:
+            self.feedback.cancel()
+        self.feedback = None
+        self.callback = None
+        self.failed = None
+
+    def is_busy(self):
+        return self.callback is not None
+
+    def on_task_finished(self, request_id, result):
+        self.tasks.pop(request_id, None)
+        if request_id != self.request_id or self.callback is None:
+            return  # outdated
+        callback, failed = self.callback, self.failed
+        self.feedback = None
+        self.callback = None
+        self.failed = None
+        if result is not None:
+            callback(result)
+        elif failed is not None:
+            failed()
@@ -25,8 +25,6 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
-import shutil
-import tempfile
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
@@ -34,7 +32,7 @@ from qgis.PyQt.QtCore import *
 from qgis.core import *
 from qgis.gui import *
 
-from ..animation import traceAnimation, images_to_video
+from ..animation import traceAnimation, images_to_video, FfmpegPipeSink
 from .utils import load_ui, handle_ffmpeg
 
 
@@ -96,18 +94,16 @@ class CrayfishTraceAnimationDialog(qtBaseClass, uiDialog):
 
         self.buttonBox.setEnabled(False)
 
-        tmpdir = tempfile.mkdtemp(prefix='crayfish')
+        # without intermediate images the frames are streamed to ffmpeg directly
         deleteIntermediateImages = self.radDelTmpImg.isChecked()
-
-        if not deleteIntermediateImages:
-            tmpdir = self.editImgTmpPath.text()
+        tmpdir = None if deleteIntermediateImages else self.editImgTmpPath.text()
 
         #General settings
         w = self.spinWidth.value()
         h = self.spinHeight.value()
         duration = self.spinDuration.value()
         fps = self.spinSpeed.value()
-        img_output_tpl = os.path.join(tmpdir, "%05d.png")
+        img_output_tpl = os.path.join(tmpdir, "%05d.png") if tmpdir else None
 
         #Particles Settings
         color=self.particleColorButton.color()
@@ -142,25 +138,33 @@ class CrayfishTraceAnimationDialog(qtBaseClass, uiDialog):
               'persistence':persistence,
               }
 
-        traceAnimation(d, prog)
-
-        ffmpeg_res, logfile = images_to_video(img_output_tpl, output_file, fps, self.quality(), ffmpeg_bin)
-
-        if ffmpeg_res and deleteIntermediateImages:
-            shutil.rmtree(tmpdir)
-
-        QApplication.restoreOverrideCursor()
-
-        self.updateProgress(0,1)
-
-        self.buttonBox.setEnabled(True)
+        try:
+            if deleteIntermediateImages:
+                sink = FfmpegPipeSink(output_file, fps, self.quality(), ffmpeg_bin)
+                try:
+                    traceAnimation(d, prog, sink)
+                except RuntimeError:
+                    if not sink.broken:  # ffmpeg is fine, the rendering has failed
+                        raise
+                finally:
+                    sink.close()
+                ffmpeg_res, logfile = sink.ok, sink.logfile
+            else:
+                traceAnimation(d, prog)
+                ffmpeg_res, logfile = images_to_video(img_output_tpl, output_file, fps, self.quality(), ffmpeg_bin)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+            self.updateProgress(0,1)
+
+            self.buttonBox.setEnabled(True)
 
         if ffmpeg_res:
             QMessageBox.information(self, "Export", "The export of animation was successful!")
         else:
             QMessageBox.warning(self, "Export",
-                "An error occurred when converting images to video. "
-                "The images are still available in " + tmpdir + "\n\n"
+                "An error occurred when converting images to video. " +
+                ("The images are still available in " + tmpdir + "\n\n" if tmpdir else "\n\n") +
                 "This should not happen. Please file a ticket in "
                 "Crayfish issue tracker with the contents from the log file:\n" + logfile)
 
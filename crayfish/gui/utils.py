@@ -37,6 +37,41 @@ qgis_message_bar = iface.messageBar()
 
 from .install_helper import downloadFfmpeg
 
+# minimal delay between two hover updates [ms], roughly the display refresh rate
+HOVER_UPDATE_INTERVAL = 16
+
+
+class HoverThrottle(QObject):
+    """ coalesces frequent requests (e.g. from mouse moves) and calls fn
+    with the arguments of the most recent one at most once per interval """
+
+    def __init__(self, fn, interval=HOVER_UPDATE_INTERVAL, parent=None):
+        QObject.__init__(self, parent)
+        self.fn = fn
+        self.pending = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def request(self, *args):
+        """ replace the pending request, older ones are dropped """
+        self.pending = args
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def discard(self):
+        """ drop the pending request """
+        self.pending = None
+        self.timer.stop()
+
+    def on_timeout(self):
+        args = self.pending
+        self.pending = None
+        if args is not None:
+            self.fn(*args)
+
+
 def float_safe(txt):
     """ convert to float, return 0 if conversion is not possible """
     try:
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from functools import partial
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsMesh, QgsMeshDatasetIndex, QgsProject, QgsTask
+
+from .mesh_graph import EdgeGraph, VertexSnapper
+from .mesh_index import TriangleIndex
+from .utils import barycentric_weights
+
+# guards _cache and _topology, which are used from the GUI thread and from plot workers
+_lock = threading.RLock()
+# layer id -> { key: cached object }
+_cache = {}
+# layer id -> topology stamp of the layer when topology dependent objects were cached
+_topology = {}
+# ids of layers with connected invalidation signals
+_watched_layers = set()
+
+# keys of cached objects which depend only on mesh topology and its coordinates, not on datasets
+TOPOLOGY_KEYS = {'geometry', 'triangle_index', 'edges', 'edge_graph', 'vertex_snapper', 'line_samplings'}
+
+
+# maximum number of unused values read in between of two requested values
+# before the read is split into separate data blocks
+BLOCK_MAX_GAP = 4096
+
+# default limit [MB] of memory for values held at once by an extraction,
+# can be changed with /crayfish/extraction_memory_mb setting
+EXTRACTION_MEMORY_MB = 256
+
+
+def extraction_memory():
+    """ return number of bytes an extraction may use for values held at once """
+    mb = QSettings().value('/crayfish/extraction_memory_mb', EXTRACTION_MEMORY_MB, type=int)
+    return max(mb, 1) * 1024 * 1024
+
+
+def invalidate(layer_id):
+    """ drop everything cached for the layer """
+    with _lock:
+        _cache.pop(layer_id, None)
+        _topology.pop(layer_id, None)
+
+
+def invalidate_datasets(layer_id):
+    """ drop cached objects depending on datasets of the layer, keep those depending on topology """
+    with _lock:
+        entries = _cache.get(layer_id)
+        if entries is not None:
+            for key in [key for key in entries if key not in TOPOLOGY_KEYS]:
+                del entries[key]
+
+
+def _forget(layer_id):
+    invalidate(layer_id)
+    with _lock:
+        _watched_layers.discard(layer_id)
+
+
+def _watch(layer):
+    layer_id = layer.id()
+    with _lock:
+        if layer_id in _watched_layers:
+            return
+        _watched_layers.add(layer_id)
+    layer.dataChanged.connect(partial(invalidate_datasets, layer_id))
+    layer.dataSourceChanged.connect(partial(invalidate, layer_id))
+    layer.willBeDeleted.connect(partial(_forget, layer_id))
+
+
+def topology_stamp(layer):
+    """ return a cheap fingerprint of the layer's mesh which changes with the topology
+    or with coordinates of the triangular mesh (e.g. when the destination CRS changes) """
+    dp = layer.dataProvider()
+    counts = (dp.vertexCount(), dp.faceCount(), dp.edgeCount()) if dp is not None else None
+    triangular_mesh = layer.triangularMesh()
+    if triangular_mesh is None:
+        return counts, None
+    extent = triangular_mesh.extent()
+    return counts, (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+
+
+def _check_topology(layer):
+    """ drop topology dependent objects if the mesh has changed since they were cached """
+    layer_id = layer.id()
+    stamp = topology_stamp(layer)
+    with _lock:
+        if _topology.get(layer_id) != stamp:
+            entries = _cache.get(layer_id, {})
+            for key in [key for key in entries if key in TOPOLOGY_KEYS]:
+                del entries[key]
+            _topology[layer_id] = stamp
+
+
+def lookup(layer, key):
+    """ return object stored for the layer under the key or None """
+    if key in TOPOLOGY_KEYS:
+        _check_topology(layer)
+    with _lock:
+        return _cache.get(layer.id(), {}).get(key)
+
+
+def store(layer, key, value):
+    """ store object for the layer under the key """
+    if key in TOPOLOGY_KEYS:
+        _check_topology(layer)
+    _watch(layer)
+    with _lock:
+        _cache.setdefault(layer.id(), {})[key] = value
+
+
+def cached(layer, key, factory):
+    """ return object stored for the layer under the key,
+    create it with factory() if it is not cached yet.
+    Nothing is stored when factory() returns None. The lock is not held
+    while factory() runs, so two threads may rarely create the same object """
+    value = lookup(layer, key)
+    if value is not None:
+        return value
+
+    value = factory()
+    if value is not None:
+        store(layer, key, value)
+    return value
+
+
+class MeshGeometry:
+    """ numpy copy of the triangular mesh of a mesh layer
+
+    Coordinates are in the same CRS as the layer's triangular mesh,
+    i.e. the same as used by QgsMeshLayer.datasetValue() """
+
+    def __init__(self, vertices, triangles, triangle_faces):
+        self.vertices = vertices              # (n, 2) x,y
+        self.triangles = triangles            # (m, 3) vertex indexes
+        self.triangle_faces = triangle_faces  # (m,) native face index of each triangle
+
+    @classmethod
+    def from_triangular_mesh(cls, triangular_mesh):
+        vertices = np.array([(v.x(), v.y()) for v in triangular_mesh.vertices()], dtype=float).reshape(-1, 2)
+        triangles = np.array(triangular_mesh.triangles(), dtype=np.int64).reshape(-1, 3)
+        triangle_faces = np.array(triangular_mesh.trianglesToNativeFaces(), dtype=np.int64)
+        return cls(vertices, triangles, triangle_faces)
+
+    def interpolation_weights(self, xy, triangles, tolerance=1e-9):
+        """ return (n, 3) barycentric weights of x,y points for vertices of their triangles,
+        NaN for triangle -1 """
+        triangles = np.asarray(triangles, dtype=np.int64)
+        tri_xy = self.vertices[self.triangles[np.maximum(triangles, 0)]]
+        weights = barycentric_weights(xy, tri_xy[:, 0], tri_xy[:, 1], tri_xy[:, 2], tolerance)
+        weights[triangles < 0] = np.nan
+        return weights
+
+
+def mesh_geometry(layer):
+    """ return cached MeshGeometry of the layer or None
+    when the layer has no triangular mesh (e.g. it has not been rendered yet) """
+    def create():
+        triangular_mesh = layer.triangularMesh()
+        if triangular_mesh is None:
+            return None
+        geometry = MeshGeometry.from_triangular_mesh(triangular_mesh)
+        if len(geometry.triangles) == 0:
+            return None
+        return geometry
+
+    return cached(layer, 'geometry', create)
+
+
+def triangle_index(layer):
+    """ return cached TriangleIndex of the layer's triangular mesh or None
+    when the layer has no triangular mesh """
+    def create():
+        geometry = mesh_geometry(layer)
+        if geometry is None:
+            return None
+        return TriangleIndex(geometry.vertices, geometry.triangles)
+
+    return cached(layer, 'triangle_index', create)
+
+
+class MeshEdges:
+    """ numpy copy of vertices and edges (1D elements) of a mesh layer
+
+    Coordinates are in the same CRS as the layer's triangular mesh """
+
+    def __init__(self, vertices, edges):
+        self.vertices = vertices  # (n, 2) x,y
+        self.edges = edges        # (m, 2) vertex indexes
+        self._edge_keys = None
+        self._edge_order = None
+
+    @classmethod
+    def from_triangular_mesh(cls, triangular_mesh):
+        vertices = np.array([(v.x(), v.y()) for v in triangular_mesh.vertices()], dtype=float).reshape(-1, 2)
+        edges = np.array(triangular_mesh.edges(), dtype=np.int64).reshape(-1, 2)
+        return cls(vertices, edges)
+
+    @classmethod
+    def from_mesh(cls, mesh):
+        """ copy of native QgsMesh, coordinates are in the layer's CRS """
+        vertices = np.array([(v.x(), v.y()) for v in (mesh.vertex(i) for i in range(mesh.vertexCount()))],
+                            dtype=float).reshape(-1, 2)
+        edges = np.array([tuple(mesh.edge(i)) for i in range(mesh.edgeCount())], dtype=np.int64).reshape(-1, 2)
+        return cls(vertices, edges)
+
+    def _key(self, v0, v1):
+        v0, v1 = np.asarray(v0, dtype=np.int64), np.asarray(v1, dtype=np.int64)
+        return np.minimum(v0, v1) * len(self.vertices) + np.maximum(v0, v1)
+
+    def edge_indexes(self, v0, v1):
+        """ return indexes of edges connecting vertices v0[i] and v1[i], -1 if there is no such edge """
+        if self._edge_keys is None:
+            keys = self._key(self.edges[:, 0], self.edges[:, 1])
+            self._edge_order = np.argsort(keys, kind='stable')
+            self._edge_keys = keys[self._edge_order]
+
+        keys = self._key(v0, v1)
+        if len(self._edge_keys) == 0:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._edge_keys, keys), len(self._edge_keys) - 1)
+        return np.where(self._edge_keys[pos] == keys, self._edge_order[pos], -1)
+
+
+def mesh_edges(layer):
+    """ return cached MeshEdges of the layer or None when the layer has no edges
+
+    When the layer has not been rendered yet (no triangular mesh), edges are copied
+    from the native mesh of the data provider. They are replaced by the triangular mesh
+    ones once it exists, as its extent is a part of the topology stamp """
+    def create():
+        triangular_mesh = layer.triangularMesh()
+        if triangular_mesh is not None:
+            edges = MeshEdges.from_triangular_mesh(triangular_mesh)
+        else:
+            dp = layer.dataProvider()
+            if dp is None or not dp.contains(QgsMesh.ElementType.Edge):
+                return None
+            mesh = QgsMesh()
+            dp.populateMesh(mesh)
+            edges = MeshEdges.from_mesh(mesh)
+        if len(edges.edges) == 0:
+            return None
+        return edges
+
+    return cached(layer, 'edges', create)
+
+
+class EdgeGraphTask(QgsTask):
+    """ builds EdgeGraph and VertexSnapper of mesh edges in background
+
+    The edges are a numpy copy made on the main thread, the task never touches
+    the layer's triangular mesh which may be replaced while the task runs.
+    When finished successfully, the graph and the snapper are stored in the cache
+    under 'edge_graph' and 'vertex_snapper' keys """
+
+    def __init__(self, layer, edges):
+        QgsTask.__init__(self, "Preparing network of " + layer.name(), QgsTask.Flag.CanCancel)
+        self.layer_id = layer.id()
+        self.edges = edges
+        self.graph = None
+        self.snapper = None
+
+    def run(self):
+        self.graph = EdgeGraph(self.edges.vertices, self.edges.edges)
+        self.setProgress(80)
+        if self.isCanceled():
+            return False
+
+        self.snapper = VertexSnapper(self.edges.vertices)
+        self.setProgress(100)
+        return True
+
+    def finished(self, result):
+        layer = QgsProject.instance().mapLayer(self.layer_id)
+        if not result or layer is None or lookup(layer, 'edges') is not self.edges:
+            return  # the layer's mesh has changed since the task was started
+
+        store(layer, 'edge_graph', self.graph)
+        store(layer, 'vertex_snapper', self.snapper)
+
+
+def dataset_times(layer, ds_group_index):
+    """ return cached read-only numpy array with times [h] of all datasets in the group """
+    def create():
+        dp = layer.dataProvider()
+        times = np.array([dp.datasetMetadata(QgsMeshDatasetIndex(ds_group_index, i)).time()
+                          for i in range(dp.datasetCount(ds_group_index))], dtype=float)
+        times.setflags(write=False)
+        return times
+
+    if ds_group_index is None or ds_group_index < 0 or layer.dataProvider() is None:
+        return np.array([], dtype=float)
+
+    return cached(layer, ('times', ds_group_index), create)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import heapq
+import math
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class EdgeGraph:
+    """ undirected graph of mesh vertices connected by edges,
+    stored as adjacency arrays in compressed sparse row (CSR) format
+
+    Neighbours of vertex v are indices[indptr[v]:indptr[v + 1]]
+    and lengths of the edges to them are in weights at the same positions """
+
+    def __init__(self, vertices, edges):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        n = len(self.vertices)
+
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+        lengths = np.hypot(*(self.vertices[edges[:, 1]] - self.vertices[edges[:, 0]]).T)
+        order = np.argsort(src, kind='stable')
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+        self.indices = dst[order]
+        self.weights = np.concatenate((lengths, lengths))[order]
+
+        # plain lists are much faster than numpy arrays for element access in the search loop
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._weights = self.weights.tolist()
+        self._x = self.vertices[:, 0].tolist()
+        self._y = self.vertices[:, 1].tolist()
+
+    def neighbours(self, vertex):
+        return self.indices[self.indptr[vertex]:self.indptr[vertex + 1]]
+
+    def shortest_path(self, source, target):
+        """ return list of vertex indexes of the shortest path from source to target (both included)
+        or None if the target can't be reached. Uses A* search with straight line distance heuristic """
+        if source == target:
+            return [source]
+
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        xs, ys = self._x, self._y
+        tx, ty = xs[target], ys[target]
+
+        dist = {source: 0.}
+        previous = {}
+        closed = set()
+        heap = [(math.hypot(xs[source] - tx, ys[source] - ty), 0., source)]
+        while heap:
+            _, d, v = heapq.heappop(heap)
+            if v == target:
+                break
+            if v in closed:
+                continue
+            closed.add(v)
+            for k in range(indptr[v], indptr[v + 1]):
+                u = indices[k]
+                du = d + weights[k]
+                if du < dist.get(u, math.inf):
+                    dist[u] = du
+                    previous[u] = v
+                    heapq.heappush(heap, (du + math.hypot(xs[u] - tx, ys[u] - ty), du, u))
+        else:
+            return None
+
+        path = [target]
+        while path[-1] != source:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path
+
+
+class VertexSnapper:
+    """ finds the nearest vertex to a point
+
+    Uses KD-tree from scipy when available, otherwise vertices
+    are bucketed into a regular grid of cells """
+
+    def __init__(self, vertices, use_kdtree=True):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        self.tree = None
+        if use_kdtree and cKDTree is not None and len(self.vertices):
+            self.tree = cKDTree(self.vertices)
+            return
+
+        n = max(len(self.vertices), 1)
+        self.origin = self.vertices.min(axis=0) if len(self.vertices) else np.zeros(2)
+        size = np.ptp(self.vertices, axis=0) if len(self.vertices) else np.ones(2)
+        # about one vertex per cell on average
+        self.cell = max(math.sqrt(size[0] * size[1] / n), size.max() / n, 1e-12)
+        self.columns = int(size[0] // self.cell) + 1
+        self.rows = int(size[1] // self.cell) + 1
+        cells = self._cells(self.vertices)
+        self.order = np.argsort(cells[:, 0] * self.rows + cells[:, 1], kind='stable')
+        self.keys = (cells[:, 0] * self.rows + cells[:, 1])[self.order]
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell).astype(np.int64)
+
+    def nearest(self, x, y, radius=math.inf):
+        """ return index of the vertex nearest to x,y within radius or -1 """
+        if len(self.vertices) == 0:
+            return -1
+
+        if self.tree is not None:
+            distance, index = self.tree.query((x, y), distance_upper_bound=radius)
+            return int(index) if math.isfinite(distance) else -1
+
+        # range of cells overlapping the search square, limited to the grid
+        low = np.floor((np.array([x, y]) - radius - self.origin) / self.cell)
+        high = np.floor((np.array([x, y]) + radius - self.origin) / self.cell)
+        c0, r0 = np.maximum(low, 0).astype(np.int64)
+        c1, r1 = np.minimum(high, [self.columns - 1, self.rows - 1]).astype(np.int64)
+
+        candidates = []
+        for column in range(c0, c1 + 1):
+            start = np.searchsorted(self.keys, column * self.rows + r0, side='left')
+            end = np.searchsorted(self.keys, column * self.rows + r1, side='right')
+            candidates.append(self.order[start:end])
+        candidates = np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+        if len(candidates) == 0:
+            return -1
+
+        distances = np.hypot(self.vertices[candidates, 0] - x, self.vertices[candidates, 1] - y)
+        best = np.argmin(distances)
+        return int(candidates[best]) if distances[best] <= radius else -1
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import math
+
+import numpy as np
+
+from .utils import barycentric_weights
+
+
+class TriangleIndex:
+    """ locates points in triangles of a mesh
+
+    Triangles are bucketed by their bounding boxes into a regular grid of cells
+    stored in compressed sparse row format (cell -> triangles), so the points
+    are located in batch with only a few candidate triangles per point """
+
+    # number of point-triangle candidate pairs tested at once
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, vertices, triangles):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+        n = max(len(self.triangles), 1)
+        tri_xy = self.vertices[self.triangles]               # (m, 3, 2)
+        lower = tri_xy.min(axis=1) if len(self.triangles) else np.zeros((0, 2))
+        upper = tri_xy.max(axis=1) if len(self.triangles) else np.zeros((0, 2))
+        self.origin = lower.min(axis=0) if len(self.triangles) else np.zeros(2)
+        size = (upper.max(axis=0) - self.origin) if len(self.triangles) else np.ones(2)
+        # about one triangle per cell on average
+        self.cell = max(math.sqrt(size[0] * size[1] / n), size.max() / n, 1e-12)
+        self.columns = int(size[0] // self.cell) + 1
+        self.rows = int(size[1] // self.cell) + 1
+
+        # all (cell, triangle) pairs of cells overlapping triangle bounding boxes
+        c0, r0 = self._cells(lower).T
+        c1, r1 = self._cells(upper).T
+        widths, heights = c1 - c0 + 1, r1 - r0 + 1
+        counts = widths * heights
+        triangle = np.repeat(np.arange(len(self.triangles)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        column = c0[triangle] + k // heights[triangle]
+        row = r0[triangle] + k % heights[triangle]
+
+        cells = column * self.rows + row
+        order = np.argsort(cells, kind='stable')
+        self.cell_triangles = triangle[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.columns * self.rows + 1))
+
+    def _cells(self, xy):
+        cells = np.floor((xy - self.origin) / self.cell)
+        return np.clip(cells, -1, [self.columns, self.rows]).astype(np.int64)
+
+    def _segment_cells(self, p0, p1):
+        """ return indexes of grid cells the segment p0-p1 passes through """
+        g0 = (np.asarray(p0, dtype=float) - self.origin) / self.cell
+        g1 = (np.asarray(p1, dtype=float) - self.origin) / self.cell
+        d = g1 - g0
+
+        # parameters along the segment where it crosses grid lines
+        t = [np.array([0., 1.])]
+        for axis in range(2):
+            if d[axis] != 0:
+                lo, hi = sorted((g0[axis], g1[axis]))
+                lines = np.arange(math.ceil(lo), math.floor(hi) + 1)
+                t.append((lines - g0[axis]) / d[axis])
+        t = np.unique(np.clip(np.concatenate(t), 0., 1.))
+        # cells of the crossings themselves and of the middles of parts between them
+        t = np.concatenate((t, (t[:-1] + t[1:]) / 2))
+
+        column, row = self._cells(g0 * self.cell + self.origin + t[:, np.newaxis] * d * self.cell).T
+        inside_grid = (column >= 0) & (column < self.columns) & (row >= 0) & (row < self.rows)
+        return np.unique(column[inside_grid] * self.rows + row[inside_grid])
+
+    def segment_triangles(self, p0, p1):
+        """ return sorted indexes of candidate triangles the segment p0-p1 may intersect,
+        all triangles it intersects are among them """
+        cells = self._segment_cells(p0, p1)
+        starts, ends = self.cell_start[cells], self.cell_start[cells + 1]
+        counts = ends - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.unique(self.cell_triangles[np.repeat(starts, counts) + offsets])
+
+    def locate(self, xy, tolerance=1e-9):
+        """ return (n,) triangle indexes of x,y points (-1 outside of the mesh)
+        and (n, 3) barycentric weights of the points in their triangles (NaN outside) """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        found = np.full(len(xy), -1, dtype=np.int64)
+        weights = np.full((len(xy), 3), np.nan)
+        if len(xy) == 0 or len(self.triangles) == 0:
+            return found, weights
+
+        column, row = self._cells(xy).T
+        inside_grid = (column >= 0) & (column < self.columns) & (row >= 0) & (row < self.rows)
+        cells = np.where(inside_grid, column * self.rows + row, 0)
+        starts = self.cell_start[cells]
+        counts = np.where(inside_grid, self.cell_start[cells + 1] - starts, 0)
+
+        # split points so that the number of tested pairs is limited
+        bounds = np.searchsorted(np.cumsum(counts), np.arange(self.CHUNK_SIZE, counts.sum(), self.CHUNK_SIZE))
+        for chunk in np.split(np.arange(len(xy)), np.unique(bounds)):
+            self._locate_chunk(xy, chunk, starts[chunk], counts[chunk], found, weights, tolerance)
+        return found, weights
+
+    def _locate_chunk(self, xy, points, starts, counts, found, weights, tolerance):
+        point = np.repeat(points, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        triangle = self.cell_triangles[np.repeat(starts, counts) + offsets]
+        if len(triangle) == 0:
+            return
+
+        tri_xy = self.vertices[self.triangles[triangle]]
+        w = barycentric_weights(xy[point], tri_xy[:, 0], tri_xy[:, 1], tri_xy[:, 2], tolerance)
+        inside = np.nonzero(np.isfinite(w[:, 0]))[0]
+        # the first containing triangle of each point wins (points on shared edges)
+        _, first = np.unique(point[inside], return_index=True)
+        hits = inside[first]
+        found[point[hits]] = triangle[hits]
+        weights[point[hits]] = w[hits]
@@ -24,13 +24,16 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import math
+import os
+from collections import OrderedDict
+
+import numpy as np
 
 from qgis.PyQt.QtWidgets import *
 from qgis.PyQt.QtGui import *
 from qgis.core import *
 
-from qgis.PyQt.QtCore import PYQT_VERSION_STR
+from qgis.PyQt.QtCore import PYQT_VERSION_STR, QSettings
 
 try:
     import pyqtgraph as pg
@@ -39,7 +42,11 @@ except ImportError:
     import crayfish.pyqtgraph_0_13_7 as pg
     from crayfish.pyqtgraph_0_13_7.exporters import ImageExporter
 
-from .utils import integrate
+from .mesh_cache import cached, mesh_geometry, mesh_edges, dataset_times, triangle_index, \
+    BLOCK_MAX_GAP, extraction_memory
+from .timeseries_store import TimeSeriesStore, series_key, quantize
+from .utils import integrate, index_ranges, split_ranges, segment_crossings, resample_regular, regular_positions, \
+    pad_ragged, pad_columns, vector_depth_average, column_mesh
 
 pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
@@ -72,81 +79,603 @@ def check_if_PyQt_version_is_before(M,m,r):
 # see https://github.com/pyqtgraph/pyqtgraph/issues/1057
 pyqtGraphAcceptNaN = check_if_PyQt_version_is_before(5, 13, 1)
 
-def timeseries_plot_data(layer, ds_group_index, geometry, searchradius=0):
-    """ return array with tuples defining X,Y points for plot """
-    x,y = [], []
+def timestep_chunks(count, row_size, memory=None):
+    """ return ranges of timesteps with at most memory bytes of row_size float values per timestep """
+    if memory is None:
+        memory = extraction_memory()
+    rows = max(int(memory // (8 * max(row_size, 1))), 1)
+    return [range(start, min(start + rows, count)) for start in range(0, count, rows)]
+
+
+class DatasetBlockReader:
+    """ reads values of a fixed set of mesh elements (faces or vertices)
+    for any dataset of a group with a few contiguous QgsMeshDataBlock reads
+
+    Only values of the requested elements are kept. A single read holds at most
+    memory bytes (the extraction memory setting by default) of values """
+
+    def __init__(self, layer, ds_group_index, indexes, max_gap=BLOCK_MAX_GAP, memory=None):
+        self.layer = layer
+        self.ds_group_index = ds_group_index
+        self.is_vector = layer.dataProvider().datasetGroupMetadata(ds_group_index).isVector()
+
+        if memory is None:
+            memory = extraction_memory()
+        indexes = np.asarray(indexes, dtype=np.int64)
+        unique, inverse = np.unique(indexes, return_inverse=True)
+        self.ranges = split_ranges(index_ranges(unique, max_gap), memory // (8 * 2))
+        # requested indexes inside of each range (relative to its start), in order of the unique indexes
+        ends = np.searchsorted(unique, [start + count for start, count in self.ranges])
+        begins = np.concatenate(([0], ends[:-1])).astype(np.int64)
+        self.local = [unique[b:e] - start for (start, _), b, e in zip(self.ranges, begins, ends)]
+        self.count = len(unique)
+        # position of each requested index in the unique indexes
+        self.positions = inverse.reshape(indexes.shape)
+
+    def values(self, ds_index):
+        """ return x and y (None for scalar groups) components of values """
+        index = QgsMeshDatasetIndex(self.ds_group_index, ds_index)
+        components = 2 if self.is_vector else 1
+        data = np.full((self.count, components), np.nan)
+        offset = 0
+        for (start, count), local in zip(self.ranges, self.local):
+            block = self.layer.datasetValues(index, start, count)
+            if block.isValid() and block.count() == count:
+                data[offset:offset + len(local)] = np.array(block.values(), dtype=float).reshape(count, components)[local]
+            offset += len(local)
+        data = data[self.positions]
+        if self.is_vector:
+            return data[..., 0], data[..., 1]
+        return data[..., 0], None
+
+    def active(self, ds_index):
+        """ return boolean array with active flags of the (face) indexes """
+        index = QgsMeshDatasetIndex(self.ds_group_index, ds_index)
+        # the provider may not support active flags
+        data = np.ones(self.count, dtype=bool)
+        offset = 0
+        for (start, count), local in zip(self.ranges, self.local):
+            flags = self.layer.areFacesActive(index, start, count).active()
+            if len(flags) == count:
+                data[offset:offset + len(local)] = np.array(flags, dtype=bool)[local]
+            offset += len(local)
+        return data[self.positions]
+
+
+class Volume3dBlockReader(DatasetBlockReader):
+    """ reads vertical profiles of 3D (volume) datasets for a fixed set of faces
+    with a few contiguous QgsMesh3dDataBlock reads """
+
+    def profiles(self, ds_index):
+        """ return (levels, components) arrays for the faces padded with NaN,
+        levels with shape (faces, volumes + 1) and a list of one (scalar) or two (vector x, y)
+        component arrays with shape (faces, volumes) """
+        index = QgsMeshDatasetIndex(self.ds_group_index, ds_index)
+        n_components = 2 if self.is_vector else 1
+        parts = []
+        for (start, count), local in zip(self.ranges, self.local):
+            block = self.layer.dataset3dValues(index, start, count)
+            if not block.isValid() or block.count() != count:
+                parts.append((np.full((len(local), 1), np.nan), [np.empty((len(local), 0))] * n_components))
+                continue
+            volumes = np.array(block.verticalLevelsCount(), dtype=np.int64)
+            values = np.array(block.values(), dtype=float)
+            components = [values[i::n_components] for i in range(n_components)]
+            # faces without volumes have no levels at all
+            levels = pad_ragged(block.verticalLevels(), np.where(volumes > 0, volumes + 1, 0))
+            parts.append((levels[local], [pad_ragged(c, volumes)[local] for c in components]))
+
+        width = max([part[1][0].shape[1] for part in parts], default=0)
+        levels = np.concatenate([pad_columns(part[0], width + 1) for part in parts]) if parts else np.empty((0, 1))
+        components = [np.concatenate([pad_columns(part[1][i], width) for part in parts]) if parts else np.empty((0, 0))
+                      for i in range(n_components)]
+        return levels[self.positions], [c[self.positions] for c in components]
+
+
+class PlotMesh:
+    """ mesh data of a layer needed to compute its plots, prepared in the GUI thread
+
+    The layer's triangular mesh belongs to the layer and is replaced when the layer is rendered
+    (e.g. with another destination CRS), so plot workers must not touch it. PlotMesh holds
+    numpy copies of it from mesh_cache and values derived from it, the workers then only read
+    datasets from the data provider. The geometry and the index are None when the layer
+    has no triangular mesh (it has not been rendered yet). The averaging method of 3D datasets
+    is a copy too, as it belongs to the layer's renderer settings """
+
+    def __init__(self, layer, ds_group_index=None, edges=False):
+        self.geometry = mesh_geometry(layer)
+        self.index = triangle_index(layer) if self.geometry is not None else None
+        self.edges = mesh_edges(layer) if edges else None
+        # shared by plot workers, which run one by one in a single thread
+        self.line_samplings = cached(layer, 'line_samplings', OrderedDict)
+        method = layer.rendererSettings().averagingMethod()
+        self.averaging_method = method.clone() if method is not None else None
+        if ds_group_index is not None and timeseries_store_enabled():
+            self.series_source, self.quantum = _series_source(layer, ds_group_index)
+        else:
+            self.series_source, self.quantum = None, None
+
+
+def locate_points(mesh, xy):
+    """ return indexes of triangles of PlotMesh containing x,y points (-1 outside of mesh)
+    and (n, 3) barycentric weights of the points in them """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if mesh.index is None:
+        return np.full(len(xy), -1, dtype=np.int64), np.full((len(xy), 3), np.nan)
+    return mesh.index.locate(xy)
+
+
+class MeshSampler:
+    """ interpolates values of datasets of a group at fixed sample points of 2D mesh layer
+
+    Sample points are defined by triangles of the layer's triangular mesh
+    (-1 for points outside of the mesh) and barycentric weights in them """
+
+    def __init__(self, layer, ds_group_index, mesh, triangles, weights):
+        self.layer = layer
+        self.ds_group_index = ds_group_index
+        data_type = layer.dataProvider().datasetGroupMetadata(ds_group_index).dataType()
+        self.on_vertices = data_type == QgsMeshDatasetGroupMetadata.DataType.DataOnVertices
+
+        geometry = mesh.geometry
+        triangles = np.array(triangles, dtype=np.int64)
+        self.valid = triangles >= 0
+        triangles[~self.valid] = 0
+        self.faces = geometry.triangle_faces[triangles]
+        self.vertices = geometry.triangles[triangles]
+        self.weights = weights
+
+        self.face_reader = DatasetBlockReader(layer, ds_group_index, self.faces)
+        if self.on_vertices:
+            self.value_reader = DatasetBlockReader(layer, ds_group_index, self.vertices)
+        else:
+            self.value_reader = self.face_reader
+
+    @classmethod
+    def at_points(cls, layer, ds_group_index, mesh, points):
+        """ create sampler for list of QgsPointXY """
+        xy = np.array([(pt.x(), pt.y()) for pt in points], dtype=float).reshape(-1, 2)
+        triangles, weights = locate_points(mesh, xy)
+        return cls(layer, ds_group_index, mesh, triangles, weights)
+
+    @staticmethod
+    def supports(layer, ds_group_index, mesh):
+        """ whether values of the group can be interpolated by MeshSampler """
+        if layer.dataProvider().contains(QgsMesh.ElementType.Edge):
+            return False
+        data_type = layer.dataProvider().datasetGroupMetadata(ds_group_index).dataType()
+        if data_type not in (QgsMeshDatasetGroupMetadata.DataType.DataOnVertices,
+                             QgsMeshDatasetGroupMetadata.DataType.DataOnFaces):
+            return False
+        return mesh.geometry is not None
+
+    def values(self, ds_index):
+        """ return scalar values (magnitudes for vectors) at the sample points """
+        x, y = self.value_reader.values(ds_index)
+        if self.on_vertices:
+            x = np.sum(x * self.weights, axis=-1)
+            if y is not None:
+                y = np.sum(y * self.weights, axis=-1)
+        if y is not None:
+            x = np.hypot(x, y)
+        x[~(self.valid & self.face_reader.active(ds_index))] = np.nan
+        return x
+
+
+class LineSampling:
+    """ exact sampling of a polyline over the triangular mesh of a layer (PlotMesh)
+
+    The polyline is split at its vertices and at all crossings with mesh
+    triangle edges, so each interval lies in a single triangle. Every interval
+    contributes its start and end station, that makes the extracted values
+    exact for both (linear) data on vertices and (constant) data on faces """
+
+    # number of line samplings kept in cache per layer
+    CACHE_SIZE = 16
+
+    def __init__(self, plot_mesh, polyline):
+        mesh, index = plot_mesh.geometry, plot_mesh.index
+        xy = np.array([(pt.x(), pt.y()) for pt in polyline], dtype=float).reshape(-1, 2)
+
+        starts, ends, stations = [], [], []
+        offset = 0.
+        for p0, p1 in zip(xy[:-1], xy[1:]):
+            length = np.hypot(*(p1 - p0))
+            # only edges of triangles in grid cells along the segment can be crossed
+            tri = mesh.triangles[index.segment_triangles(p0, p1)]
+            edges_a = mesh.vertices[tri].reshape(-1, 2)
+            edges_b = mesh.vertices[tri[:, [1, 2, 0]]].reshape(-1, 2)
+            t = np.unique(np.concatenate(([0., 1.], segment_crossings(p0, p1, edges_a, edges_b))))
+            # skip empty intervals
+            t = t[np.concatenate(([True], np.diff(t) * length > 1e-9))]
+            if len(t) < 2:
+                continue
+            pts = p0 + t[:, np.newaxis] * (p1 - p0)
+            starts.append(pts[:-1])
+            ends.append(pts[1:])
+            stations.append(offset + t * length)
+            offset += length
+
+        if len(starts) == 0:
+            self.stations = np.empty(0)
+            self.triangles = np.empty(0, dtype=np.int64)
+            self.weights = np.empty((0, 3))
+            return
+
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+        triangles, _ = locate_points(plot_mesh, (starts + ends) / 2)
+        start_weights = mesh.interpolation_weights(starts, triangles, tolerance=1e-6)
+        end_weights = mesh.interpolation_weights(ends, triangles, tolerance=1e-6)
+        start_stations = np.concatenate([st[:-1] for st in stations])
+        end_stations = np.concatenate([st[1:] for st in stations])
+
+        # interleave start and end of each interval
+        self.stations = np.column_stack((start_stations, end_stations)).reshape(-1)
+        self.triangles = np.repeat(triangles, 2)
+        self.weights = np.stack((start_weights, end_weights), axis=1).reshape(-1, 3)
+
+    @classmethod
+    def for_geometry(cls, mesh, geometry):
+        """ return cached sampling of the linestring geometry """
+        samplings = mesh.line_samplings
+        key = geometry.asWkt()
+        if key in samplings:
+            samplings.move_to_end(key)
+        else:
+            samplings[key] = cls(mesh, geometry.asPolyline())
+            while len(samplings) > cls.CACHE_SIZE:
+                samplings.popitem(last=False)
+        return samplings[key]
+
+    def sampler(self, layer, ds_group_index, mesh):
+        """ return sampler of values of the group at the stations """
+        return MeshSampler(layer, ds_group_index, mesh, self.triangles, self.weights)
+
+
+# locations closer than this fraction of the mesh extent share stored time series
+LOCATION_QUANTUM = 1e-7
+
+# default limit [MB] of the on-disk store of time series,
+# can be changed with /crayfish/timeseries_cache/max_size_mb setting
+TIMESERIES_CACHE_MB = 256
+
+_store = None
+
+
+def timeseries_store_enabled():
+    """ whether computed time series are kept in the on-disk store (off by default) """
+    return QSettings().value('/crayfish/timeseries_cache/enabled', False, type=bool)
+
+
+def set_timeseries_store_enabled(enabled):
+    QSettings().setValue('/crayfish/timeseries_cache/enabled', enabled)
+    if not enabled:
+        close_timeseries_store()
+
+
+def _timeseries_store_path():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'crayfish', 'timeseries_cache.sqlite')
+
+
+def timeseries_store():
+    """ return the on-disk store of computed time series or None when it is disabled in settings """
+    global _store
+    if not timeseries_store_enabled():
+        return None
+
+    path = _timeseries_store_path()
+    max_size = QSettings().value('/crayfish/timeseries_cache/max_size_mb', TIMESERIES_CACHE_MB, type=int) * 1024 * 1024
+    if _store is None or _store.path != path or _store.max_size != max_size:
+        if _store is not None:
+            _store.close()
+            _store = None
+        try:
+            _store = TimeSeriesStore(path, max_size)
+        except Exception as e:
+            QgsMessageLog.logMessage("Unable to open time series cache: " + str(e), "Crayfish", Qgis.MessageLevel.Warning)
+            return None
+    return _store
+
+
+def close_timeseries_store():
+    """ write pending access times of the on-disk store and close it """
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def timeseries_store_size():
+    """ return size [bytes] of the on-disk store file, 0 if it does not exist """
+    try:
+        return os.path.getsize(_timeseries_store_path())
+    except OSError:
+        return 0
+
+
+def clear_timeseries_store():
+    """ remove the on-disk store of time series """
+    close_timeseries_store()
+    try:
+        os.remove(_timeseries_store_path())
+    except OSError:
+        pass
+
+
+def _series_source(layer, ds_group_index):
+    """ return identification of data used for time series of the dataset group and the location quantum,
+    (None, None) if the data do not come from files on disk that could be checked for modifications """
+    dp = layer.dataProvider()
+    if dp is None or ds_group_index is None or not 0 <= ds_group_index < dp.datasetGroupCount():
+        return None, None
+
+    mesh_path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')
+    files = []
+    for path in [mesh_path] + list(dp.extraDatasets()):
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return None, None
+        files.append((os.path.abspath(path), st.st_mtime_ns, st.st_size))
+
+    # picked locations are in coordinates of the triangular mesh, which depend on the destination CRS
+    triangular_mesh = layer.triangularMesh()
+    if triangular_mesh is None:
+        return None, None
+    extent = triangular_mesh.extent()
+    quantum = max(extent.width(), extent.height(), 1.) * LOCATION_QUANTUM
+    frame = quantize([extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()], quantum)
+
+    meta = dp.datasetGroupMetadata(ds_group_index)
+    source = (tuple(files), frame, ds_group_index, meta.name(), dp.datasetCount(ds_group_index))
+    return source, quantum
+
+
+def _is_canceled(feedback):
+    return feedback is not None and feedback.isCanceled()
+
+
+def timeseries_plot_data(layer, ds_group_index, geometry, searchradius=0, feedback=None, mesh=None):
+    """ return arrays defining X,Y points for plot """
+    x, y = timeseries_plot_data_multi(layer, ds_group_index, [geometry], searchradius, feedback, mesh=mesh)
+    return x, y[0] if len(y) else y
+
+
+def timeseries_plot_data_multi(layer, ds_group_index, geometries, searchradius=0, feedback=None, persistent=None,
+                               mesh=None):
+    """ return times array and (points x times) matrix of values for point geometries
+
+    All the points are located at once and each dataset of the group
+    is read only once for all of them. When canceled with QgsFeedback,
+    values of remaining datasets are NaN.
+
+    Time series are looked up in the on-disk store first. Only time series of geometries
+    with index in persistent (all by default) are saved there, temporary ones are not.
+    In a worker thread, mesh must be a PlotMesh of the group prepared in the GUI thread """
     if not layer:
-        return x, y
+        return np.array([]), np.empty((0, 0))
+    if mesh is None:
+        mesh = PlotMesh(layer, ds_group_index)
+
+    x = dataset_times(layer, ds_group_index)
+    points = [geometry.asPoint() for geometry in geometries]
+    y = np.full((len(points), len(x)), np.nan)
+
+    store = timeseries_store()
+    source, quantum = (mesh.series_source, mesh.quantum) if store is not None else (None, None)
+    missing = list(range(len(points)))
+    if source is not None:
+        radius = quantize([searchradius], quantum)
+        keys = [series_key('timeseries', source, radius, quantize([pt.x(), pt.y()], quantum)) for pt in points]
+        missing = []
+        found = store.get_many(keys)
+        for j, key in enumerate(keys):
+            stored = found.get(key)
+            if stored is not None and len(stored[1]) == len(x):
+                y[j] = stored[1]
+            else:
+                missing.append(j)
+
+    if missing:
+        missing_points = [points[j] for j in missing]
+        completed = True
+        if MeshSampler.supports(layer, ds_group_index, mesh):
+            sampler = MeshSampler.at_points(layer, ds_group_index, mesh, missing_points)
+            for i in range(len(x)):
+                if _is_canceled(feedback):
+                    completed = False
+                    break
+                y[missing, i] = sampler.values(i)
+        else:
+            for i in range(len(x)):
+                if _is_canceled(feedback):
+                    completed = False
+                    break
+                dataset = QgsMeshDatasetIndex(ds_group_index, i)
+                y[missing, i] = [layer.datasetValue(dataset, pt, searchradius).scalar() for pt in missing_points]
 
-    pt = geometry.asPoint()
-    for i in range(layer.dataProvider().datasetCount(ds_group_index)):
-        meta = layer.dataProvider().datasetMetadata(QgsMeshDatasetIndex(ds_group_index, i))
-        t = meta.time()
-        dataset = QgsMeshDatasetIndex(ds_group_index, i)
-        value = layer.datasetValue(dataset, pt,searchradius).scalar()
-        if not pyqtGraphAcceptNaN and math.isnan(value):
-            value=0;
+        if completed and source is not None:
+            for j in missing:
+                if persistent is None or j in persistent:
+                    store.put(keys[j], x, y[j])
 
-        x.append(t)
-        y.append(value)
+    if not pyqtGraphAcceptNaN:
+        y[np.isnan(y)] = 0
 
     return x, y
 
 
-def cross_section_plot_data(layer, ds_group_index, ds_index, geometry, resolution=1.):
-    """ return array with tuples defining X,Y points for plot """
-    x,y = [], []
+def cross_section_plot_data(layer, ds_group_index, ds_index, geometry, resolution=1., mesh=None):
+    """ return arrays defining X,Y points for plot
+
+    Values are sampled exactly at crossings of the line with mesh edges when possible,
+    otherwise the line is sampled with the given resolution """
+    x, y = cross_section_plot_data_multi(layer, ds_group_index, [ds_index], geometry, resolution, mesh=mesh)
+    return x, y[0] if len(y) else np.array([])
+
+
+def cross_section_plot_data_multi(layer, ds_group_index, ds_indexes, geometry, resolution=1., feedback=None,
+                                  mesh=None):
+    """ return stations array and (datasets x stations) matrix of values along the line
+
+    The line is sampled only once and the values of all the datasets
+    are then read at the same stations. When canceled with QgsFeedback,
+    values of remaining datasets are NaN. In a worker thread, mesh must be
+    a PlotMesh prepared in the GUI thread """
     if not layer:
-        return x, y
+        return np.array([]), np.empty((0, 0))
+    if mesh is None:
+        mesh = PlotMesh(layer)
+
+    if MeshSampler.supports(layer, ds_group_index, mesh):
+        sampling = LineSampling.for_geometry(mesh, geometry)
+        x = sampling.stations
+        sample = sampling.sampler(layer, ds_group_index, mesh).values
+    else:
+        x, points = _line_stations(geometry, resolution)
+
+        def sample(ds_index):
+            dataset = QgsMeshDatasetIndex(ds_group_index, ds_index)
+            return [layer.datasetValue(dataset, pt).scalar() for pt in points]
+
+    y = np.full((len(ds_indexes), len(x)), np.nan)
+    for row, ds_index in enumerate(ds_indexes):
+        if _is_canceled(feedback):
+            break
+        y[row] = sample(ds_index)
+
+    if not pyqtGraphAcceptNaN:
+        y[np.isnan(y)] = 0
+
+    return x, y
+
+
+def cross_section_time_plot_data(layer, ds_group_index, geometry, resolution=1., feedback=None, max_size=2048,
+                                 mesh=None):
+    """ return stations, times and (times x stations) matrix of values along the line
+    for all the datasets of the group, resampled to a regular grid for display as an image
 
-    dataset = QgsMeshDatasetIndex(ds_group_index, ds_index)
-    offset = 0
+    The grid has at most max_size columns and rows. Only datasets needed for the rows
+    of the grid are read, in chunks resampled along the line right away, so the memory
+    held at once is limited by the extraction memory setting. Returns None when canceled """
+    if not layer:
+        return None
+    if mesh is None:
+        mesh = PlotMesh(layer)
+
+    times = dataset_times(layer, ds_group_index)
+    if len(times) < 2:
+        return None
+    times, i, w = regular_positions(times, min(len(times), max_size))
+    needed = np.unique(np.concatenate((i, i + 1)))
+
+    # the first dataset tells the number of stations and so the size of the chunks
+    x, rows = None, []
+    start, chunk_size = 0, 1
+    while start < len(needed):
+        stations, y = cross_section_plot_data_multi(layer, ds_group_index, needed[start:start + chunk_size],
+                                                    geometry, resolution, feedback, mesh)
+        if _is_canceled(feedback) or len(stations) < 2:
+            return None
+        x, y = resample_regular(stations, y, min(len(stations), max_size), axis=1)
+        rows.append(y)
+        start += chunk_size
+        chunk_size = len(timestep_chunks(len(needed), len(stations))[0])
+
+    y = np.concatenate(rows)
+    i, j = np.searchsorted(needed, i), np.searchsorted(needed, i + 1)
+    return x, times, y[i] * (1 - w)[:, np.newaxis] + y[j] * w[:, np.newaxis]
+
+
+def _line_stations(geometry, resolution):
+    """ return stations along the line with the given resolution and their points """
     length = geometry.length()
-    while offset < length:
-        pt = geometry.interpolate(offset).asPoint()
-        value = layer.datasetValue(dataset, pt).scalar()
-        if not pyqtGraphAcceptNaN and math.isnan(value):
-            value = 0
-        x.append(offset)
-        y.append(value)
-        offset += resolution
+    x = list(np.arange(0, length, resolution))
+    points = [geometry.interpolate(offset).asPoint() for offset in x]
 
     # let's make sure we include also the last point
-    last_pt = geometry.asPolyline()[-1]
-    last_value = layer.datasetValue(dataset, last_pt).scalar()
+    x.append(length)
+    points.append(geometry.asPolyline()[-1])
 
-    if not pyqtGraphAcceptNaN and math.isnan(last_value):
-        last_value = 0
+    return np.array(x, dtype=float), points
 
-    x.append(length)
-    y.append(last_value)
 
-    return x,y
+def integral_plot_data(layer, ds_group_index, geometry, resolution=1., feedback=None, persistent=True, mesh=None):
+    """ return arrays defining X,Y points for plot
 
-def integral_plot_data(layer, ds_group_index, geometry, resolution=1.):
-    """ return array with tuples defining X,Y points for plot """
-    x, y = [], []
+    Stations along the line are sampled once and integrals for all
+    the datasets are then calculated together. Results are looked up in the on-disk store
+    and saved there if persistent. In a worker thread, mesh must be a PlotMesh of the group
+    prepared in the GUI thread """
     if not layer:
-        return x, y
-
-    for i in range(layer.dataProvider().datasetCount(ds_group_index)):
-        meta = layer.dataProvider().datasetMetadata(QgsMeshDatasetIndex(ds_group_index, i))
-        t = meta.time()
-        cs_x, cs_y = cross_section_plot_data(layer, ds_group_index, i, geometry, resolution)
-        value = integrate(cs_x, cs_y)
-        x.append(t)
-        y.append(value)
+        return np.array([]), np.array([])
+    if mesh is None:
+        mesh = PlotMesh(layer, ds_group_index)
+
+    x = dataset_times(layer, ds_group_index)
+
+    store = timeseries_store()
+    source, quantum = (mesh.series_source, mesh.quantum) if store is not None else (None, None)
+    key = None
+    if source is not None:
+        line = [(pt.x(), pt.y()) for pt in geometry.asPolyline()]
+        key = series_key('integral', source, quantize([resolution], quantum), quantize(line, quantum))
+        stored = store.get(key)
+        if stored is not None and len(stored[1]) == len(x):
+            return x, np.array(stored[1])
+
+    completed = True
+    if MeshSampler.supports(layer, ds_group_index, mesh):
+        sampling = LineSampling.for_geometry(mesh, geometry)
+        sampler = sampling.sampler(layer, ds_group_index, mesh)
+        y = np.full(len(x), np.nan)
+        # values along the line are only held for a chunk of timesteps
+        for chunk in timestep_chunks(len(x), len(sampling.stations)):
+            values = np.full((len(chunk), len(sampling.stations)), np.nan)
+            for row, i in enumerate(chunk):
+                if _is_canceled(feedback):
+                    completed = False
+                    break
+                values[row] = sampler.values(i)
+            y[chunk.start:chunk.stop] = integrate(sampling.stations, values, axis=1)
+            if not completed:
+                break
+    else:
+        stations, points = _line_stations(geometry, resolution)
+        y = np.full(len(x), np.nan)
+        for i in range(len(x)):
+            if _is_canceled(feedback):
+                completed = False
+                break
+            dataset = QgsMeshDatasetIndex(ds_group_index, i)
+            y[i] = integrate(stations, np.array([layer.datasetValue(dataset, pt).scalar() for pt in points], dtype=float))
+
+    if completed and persistent and key is not None:
+        store.put(key, x, y)
 
     return x, y
 
-def profile_1D_plot_data(layer, dataset_group_index, dataset_index,profile):
-    """ return array with tuples defining X,Y points for plot """
+
+def profile_1D_plot_data(layer, dataset_group_index, dataset_index,profile, vertices=None, edges=None):
+    """ return array with tuples defining X,Y points for plot
+
+    When indexes of mesh vertices of the profile points are given, values are
+    read directly from a dataset block instead of searching for each point.
+    Edges are MeshEdges of the layer, in a worker thread they must be prepared in the GUI thread """
     x, y = [], []
     if not layer or len(profile)<2:
         return x, y
 
     groupMeta = layer.dataProvider().datasetGroupMetadata(dataset_group_index)
     isOnVertices = groupMeta.dataType() == QgsMeshDatasetGroupMetadata.DataType.DataOnVertices
+
+    if vertices is not None:
+        if edges is None:
+            edges = mesh_edges(layer)
+        data = _profile_1D_plot_data_by_index(layer, dataset_group_index, dataset_index, profile, vertices, edges)
+        if data is not None:
+            return data
+
     layerDataSetIndex = QgsMeshDatasetIndex(dataset_group_index,dataset_index)
 
     totalLength=0
@@ -179,6 +708,33 @@ def profile_1D_plot_data(layer, dataset_group_index, dataset_index,profile):
     return x, y
 
 
+def _profile_1D_plot_data_by_index(layer, dataset_group_index, dataset_index, profile, vertices, edges):
+    """ return X,Y arrays for plot or None if values can't be gathered by index """
+    vertices = np.asarray(vertices, dtype=np.int64)
+    if edges is None or len(vertices) != len(profile) or np.any(vertices < 0):
+        return None
+
+    data_type = layer.dataProvider().datasetGroupMetadata(dataset_group_index).dataType()
+    xy = np.array([(pt.x(), pt.y()) for pt in profile], dtype=float)
+    lengths = np.hypot(*np.diff(xy, axis=0).T)
+    stations = np.concatenate(([0.], np.cumsum(lengths)))
+
+    if data_type == QgsMeshDatasetGroupMetadata.DataType.DataOnVertices:
+        x, indexes = stations, vertices
+    elif data_type == QgsMeshDatasetGroupMetadata.DataType.DataOnEdges:
+        x = stations[:-1] + lengths / 2
+        indexes = edges.edge_indexes(vertices[:-1], vertices[1:])
+        if np.any(indexes < 0):
+            return None
+    else:
+        return None
+
+    values, values_y = DatasetBlockReader(layer, dataset_group_index, indexes).values(dataset_index)
+    if values_y is not None:
+        values = np.hypot(values, values_y)
+    return x, values
+
+
 def show_plot(*args, **kwargs):
     """ Open a new window with a plot and return the plot widget.
     Just a wrapper around pyqtgraph's plot() method """
@@ -194,27 +750,109 @@ def export_plot(plt, filename, width=None, height=None):
     e.export(filename)
 
 
-def plot_3d_data(layer, ds_group_index, ds_dataset_index, geom_pt):
-    """ return array with tuples defining X,Y points for plot """
-    average = None
-    x,y = [], []
+def _averaging_bounds(method, levels):
+    """ return lower and upper heights of the parts of columns averaged by QgsMesh3dAveragingMethod """
+    top = np.fmax.reduce(levels, axis=-1)
+    bottom = np.fmin.reduce(levels, axis=-1)
+    if isinstance(method, QgsMeshSigmaAveragingMethod):
+        return (bottom + method.startFraction() * (top - bottom),
+                bottom + method.endFraction() * (top - bottom))
+    if isinstance(method, QgsMeshRelativeHeightAveragingMethod):
+        if method.countedFromTop():
+            return top - method.endHeight(), top - method.startHeight()
+        return bottom + method.startHeight(), bottom + method.endHeight()
+    if isinstance(method, QgsMeshElevationAveragingMethod):
+        return (np.full(top.shape, min(method.startElevation(), method.endElevation())),
+                np.full(top.shape, max(method.startElevation(), method.endElevation())))
+    if isinstance(method, QgsMeshMultiLevelsAveragingMethod):
+        # levels are 1-based indexes of volumes, counted from the first volume (top) or the last one
+        volumes = np.isfinite(levels).sum(axis=-1) - 1
+        start, end = method.startVerticalLevel() - 1, method.endVerticalLevel()
+        if method.countedFromTop():
+            first, last = np.full(volumes.shape, start), np.minimum(end, volumes)
+        else:
+            first, last = np.maximum(volumes - end, 0), volumes - start
+        valid = (first < last) & (volumes > 0)
+        first, last = np.clip(first, 0, None), np.clip(last, 0, None)
+        a = np.take_along_axis(levels, first[..., np.newaxis], axis=-1)[..., 0]
+        b = np.take_along_axis(levels, last[..., np.newaxis], axis=-1)[..., 0]
+        return np.where(valid, np.minimum(a, b), np.nan), np.where(valid, np.maximum(a, b), np.nan)
+    return np.full(top.shape, -np.inf), np.full(top.shape, np.inf)
+
+
+def plot_3d_data_multi(layer, ds_group_index, ds_dataset_indexes, geoms, feedback=None, mesh=None):
+    """ return vertical profiles of 3D datasets at points as arrays
+    (levels, values, averages) with shapes (datasets, points, volumes + 1) for heights
+    of volume boundaries, (datasets, points, volumes) for values and (datasets, points)
+    for depth averages. None if there is no layer, the layer has no triangular mesh
+    (it has not been rendered yet) or the computation has been canceled
+
+    In a worker thread, mesh must be a PlotMesh prepared in the GUI thread """
     if not layer:
-        return x, y, average
+        return None
+    if mesh is None:
+        mesh = PlotMesh(layer)
+    method = mesh.averaging_method
+    geometry = mesh.geometry
+    if geometry is None:
+        return None
+
+    xy = np.array([(g.asPoint().x(), g.asPoint().y()) for g in geoms], dtype=float).reshape(-1, 2)
+    triangles, _ = locate_points(mesh, xy)
+    faces = geometry.triangle_faces[np.maximum(triangles, 0)]
+    reader = Volume3dBlockReader(layer, ds_group_index, faces)
+
+    all_levels, values, averages = [], [], []
+    for ds_index in ds_dataset_indexes:
+        if _is_canceled(feedback):
+            return None
+        levels, components = reader.profiles(ds_index)
+        levels[triangles < 0] = np.nan
+        for component in components:
+            component[triangles < 0] = np.nan
+        all_levels.append(levels)
+        values.append(components[0] if len(components) == 1 else np.hypot(*components))
+        # vector components are averaged separately, as QGIS does for the mesh rendering
+        averages.append(vector_depth_average(levels, components, *_averaging_bounds(method, levels)))
+
+    # the number of volumes may differ between datasets
+    width = max([v.shape[1] for v in values], default=0)
+    return (np.array([pad_columns(l, width + 1) for l in all_levels]).reshape(-1, len(xy), width + 1),
+            np.array([pad_columns(v, width) for v in values]).reshape(-1, len(xy), width),
+            np.array(averages).reshape(-1, len(xy)))
 
-    ds = QgsMeshDatasetIndex(ds_group_index, ds_dataset_index)
-    pt = geom_pt.asPoint()
-    block = layer.dataset3dValue(ds, pt)
-    if block.isValid():
-        nvols = block.volumesCount()
-        extrusions = block.verticalLevels()
 
-        for i in range(nvols):
-            ext = extrusions[i] + ( extrusions[i+1] - extrusions[i] ) / 2.0
-            val = block.value(i).scalar()
-            x.append(val)
-            y.append(ext)
-
-        averageVal = layer.datasetValue(ds, pt)
-        average = averageVal.scalar()
-
-    return x, y, average
+def plot_3d_data(layer, ds_group_index, ds_dataset_index, geom_pt):
+    """ return array with tuples defining X,Y points for plot """
+    data = plot_3d_data_multi(layer, ds_group_index, [ds_dataset_index], [geom_pt])
+    if data is None:
+        return [], [], None
+    return vertical_profile_curve(data[0][0, 0], data[1][0, 0], data[2][0, 0])
+
+
+def vertical_profile_curve(levels, values, average):
+    """ return x (values) and y (heights of volume middles) lists of the valid volumes
+    and the average (None if not valid) """
+    heights = (levels[:-1] + levels[1:]) / 2
+    valid = np.isfinite(heights)
+    average = float(average) if np.isfinite(average) else None
+    return values[valid].tolist(), heights[valid].tolist(), average
+
+
+def vertical_profile_time_data(layer, ds_group_index, geometry, feedback=None, max_size=512, mesh=None):
+    """ return (xs, ys, zs) color mesh (see utils.column_mesh) with vertical profiles of 3D datasets
+    of the group at a point over time. None if the computation has been canceled
+
+    The color mesh is drawn cell by cell, so at most max_size datasets are read,
+    the nearest ones to regularly spaced times. In a worker thread, mesh must be
+    a PlotMesh prepared in the GUI thread """
+    times = np.asarray(dataset_times(layer, ds_group_index), dtype=float)
+    indexes = np.arange(len(times))
+    if len(times) > max_size:
+        _, i, w = regular_positions(times, max_size)
+        indexes = np.unique(i + (w >= 0.5))
+    data = plot_3d_data_multi(layer, ds_group_index, indexes.tolist(), [geometry], feedback, mesh)
+    if data is None:
+        return None
+    levels, values, _ = data
+    return column_mesh(times[indexes], levels[:, 0], values[:, 0])
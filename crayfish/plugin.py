@@ -34,6 +34,7 @@ from .gui.animation_dialog import CrayfishAnimationDialog
 from .gui.trace_animation_dialog import CrayfishTraceAnimationDialog
 from .gui.utils import mesh_layer_active_dataset_group_with_maximum_timesteps, isLayer1d, isLayer2d, isLayer3d
 from .processing import CrayfishProcessingProvider
+from .plot import close_timeseries_store
 
 class CrayfishPlugin:
     def __init__(self, iface):
@@ -191,6 +192,8 @@ class CrayfishPlugin:
             self.iface.removeDockWidget(self.plot_dock_1d_widget)
             self.plot_dock_1d_widget = None
 
+        close_timeseries_store()
+
         QgsApplication.processingRegistry().removeProvider(self.provider)
 
     def exportAnimation(self):
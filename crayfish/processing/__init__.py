@@ -28,6 +28,7 @@ from qgis.PyQt.QtGui import *
 from qgis.core import QgsProcessingProvider
 
 from .calculator import MeshCalculatorAlgorithm
+from .statistics import MeshTimeStatisticsAlgorithm
 from .saga_flow_to_grib import SagaFlowToGribAlgorithm
 from .pcraster_flow_to_grib import PcrasterFlowToGribAlgorithm
 
@@ -57,6 +58,7 @@ class CrayfishProcessingProvider(QgsProcessingProvider):
 
     def loadAlgorithms(self):
         self.alglist = [MeshCalculatorAlgorithm(),
+                        MeshTimeStatisticsAlgorithm(),
                         SagaFlowToGribAlgorithm(),
                         PcrasterFlowToGribAlgorithm()]
 
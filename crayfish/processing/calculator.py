@@ -41,6 +41,22 @@ from .parameters import TimestepParameter
 from qgis.core import QgsProviderRegistry
 from qgis.core import QgsMeshDriverMetadata
 
+
+def mesh_write_drivers():
+    """ return names of MDAL drivers which can write dataset groups """
+    meshDrivers = []
+    providerMetadata = QgsProviderRegistry.instance().providerMetadata("mdal")
+    if providerMetadata:
+        allDrivers = providerMetadata.meshDriversMetadata()
+        for meta in allDrivers:
+            if (meta.capabilities() & QgsMeshDriverMetadata.MeshDriverCapability.CanWriteFaceDatasets) or (
+                    meta.capabilities() & QgsMeshDriverMetadata.MeshDriverCapability.CanWriteVertexDatasets):
+                meshDrivers += [meta.name()]
+    else:
+        meshDrivers = ["DAT"]
+    return meshDrivers
+
+
 class MeshCalculatorAlgorithm(QgisAlgorithm):
     INPUT_LAYER = 'CRAYFISH_INPUT_LAYER'
     INPUT_STARTTIME = 'CRAYFISH_INPUT_STARTTIME'
@@ -61,17 +77,7 @@ class MeshCalculatorAlgorithm(QgisAlgorithm):
         return QIcon(":/plugins/crayfish/images/crayfish.png")
 
     def meshWriteDrivers(self):
-        meshDrivers = []
-        providerMetadata = QgsProviderRegistry.instance().providerMetadata("mdal")
-        if providerMetadata:
-            allDrivers = providerMetadata.meshDriversMetadata()
-            for meta in allDrivers:
-                if (meta.capabilities() & QgsMeshDriverMetadata.MeshDriverCapability.CanWriteFaceDatasets) or (
-                        meta.capabilities() & QgsMeshDriverMetadata.MeshDriverCapability.CanWriteVertexDatasets):
-                    meshDrivers += [meta.name()]
-        else:
-            meshDrivers = ["DAT"]
-        return meshDrivers
+        return mesh_write_drivers()
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterMeshLayer(
@@ -30,13 +30,14 @@ from processing.tools import dataobjects
 from processing.gui.wrappers import EnumWidgetWrapper, InvalidParameterValue
 from qgis.core import (QgsProcessingParameterEnum,
                        QgsProcessingUtils,
-                       QgsMeshDatasetIndex,
                        QgsMeshLayer,
                        QgsProviderRegistry,
                        QgsDataProvider,
                        QgsMapLayerType,
                        QgsProcessingException)
 
+from ..mesh_cache import dataset_times
+
 
 class DatasetWrapper(EnumWidgetWrapper):
     """Widget wrapper for selection of datasets groups of linked mesh layer"""
@@ -137,10 +138,7 @@ class TimestepWidgetWrapper(EnumWidgetWrapper):
 
             options = []
             if groupWithMaximumDatasets > -1:
-                for i in range(datasetCount):
-                    index = QgsMeshDatasetIndex(groupWithMaximumDatasets, i)
-                    meta = dp.datasetMetadata(index)
-                    time = meta.time()
+                for i, time in enumerate(dataset_times(mesh_layer, groupWithMaximumDatasets)):
                     options.append((mesh_layer.formatTime(time), i))
         else:
             options = []
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2019 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+
+import numpy as np
+
+from qgis.PyQt.QtGui import QIcon
+from processing.algs.qgis.QgisAlgorithm import QgisAlgorithm
+from qgis.core import (QgsProcessingException,
+                       QgsProcessingParameterMeshLayer,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsMeshDataBlock,
+                       QgsMeshDatasetIndex,
+                       QgsMeshDatasetGroupMetadata)
+from .calculator import mesh_write_drivers
+from .parameters import DatasetParameter
+from ..mesh_cache import dataset_times, extraction_memory
+from ..time_statistics import TimeStatistics
+from ..utils import split_ranges
+
+SUPPORTED_DATA_TYPES = (QgsMeshDatasetGroupMetadata.DataType.DataOnVertices,
+                        QgsMeshDatasetGroupMetadata.DataType.DataOnFaces)
+
+
+class MeshTimeStatisticsAlgorithm(QgisAlgorithm):
+    INPUT_LAYER = 'CRAYFISH_INPUT_LAYER'
+    INPUT_GROUP = 'CRAYFISH_INPUT_GROUP'
+    INPUT_STATISTICS = 'CRAYFISH_INPUT_STATISTICS'
+    INPUT_THRESHOLD = 'CRAYFISH_INPUT_THRESHOLD'
+    OUTPUT_FILE = 'CRAYFISH_OUTPUT_FILE'
+    OUTPUT_DRIVER = 'CRAYFISH_OUTPUT_DRIVER'
+    OUTPUT_FILES = 'CRAYFISH_OUTPUT_FILES'
+
+    def name(self):
+        return 'CrayfishMeshTimeStatistics'
+
+    def displayName(self):
+        return 'Statistics over time'
+
+    def shortHelpString(self):
+        return ('Calculates statistics of a dataset group over all its timesteps for each vertex or face. '
+                'Magnitudes are used for vector groups. Duration above threshold is in hours, '
+                'values between timesteps change linearly. When more statistics are selected, '
+                'each is written to its own file with the statistic name appended to the file name.')
+
+    def icon(self):
+        return QIcon(":/plugins/crayfish/images/crayfish.png")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterMeshLayer(
+            self.INPUT_LAYER,
+            'Input mesh layer',
+            optional=False))
+
+        self.addParameter(DatasetParameter(
+            self.INPUT_GROUP,
+            'Dataset group',
+            self.INPUT_LAYER,
+            allowMultiple=False,
+            datasetGroupFilter=lambda meta: meta.dataType() in SUPPORTED_DATA_TYPES))
+
+        self.addParameter(QgsProcessingParameterEnum(
+            self.INPUT_STATISTICS,
+            'Statistics',
+            TimeStatistics.names,
+            allowMultiple=True,
+            defaultValue=[TimeStatistics.MAXIMUM]))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.INPUT_THRESHOLD,
+            'Threshold for duration',
+            QgsProcessingParameterNumber.Type.Double,
+            defaultValue=0.))
+
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT_FILE,
+            'Exported dataset group file',
+            'MDAL file (*.*)',
+            ))
+
+        self.drivers = mesh_write_drivers()
+        self.addParameter(QgsProcessingParameterEnum(
+            self.OUTPUT_DRIVER,
+            'Driver to write results with',
+            self.drivers
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        layer = self.parameterAsMeshLayer(parameters, self.INPUT_LAYER, context)
+        group = parameters[self.INPUT_GROUP]
+        statistics = self.parameterAsEnums(parameters, self.INPUT_STATISTICS, context)
+        threshold = self.parameterAsDouble(parameters, self.INPUT_THRESHOLD, context)
+        outputFile = self.parameterAsFileOutput(parameters, self.OUTPUT_FILE, context)
+        outputDriver = self.drivers[parameters[self.OUTPUT_DRIVER]]
+
+        dp = layer.dataProvider()
+        meta = dp.datasetGroupMetadata(group)
+        if meta.dataType() not in SUPPORTED_DATA_TYPES:
+            raise QgsProcessingException("Only dataset groups defined on vertices or faces are supported")
+        on_faces = meta.dataType() == QgsMeshDatasetGroupMetadata.DataType.DataOnFaces
+        count = dp.faceCount() if on_faces else dp.vertexCount()
+        components = 1 if meta.isScalar() else 2
+
+        # one timestep (in chunks of values) at a time, only running statistics are kept
+        times = dataset_times(layer, group)
+        stats = TimeStatistics(count, threshold)
+        # a single read holds at most the extraction memory setting of values
+        chunks = split_ranges([(0, count)], max(extraction_memory() // (8 * components), 1))
+        for i, time in enumerate(times):
+            if feedback.isCanceled():
+                return {}
+            index = QgsMeshDatasetIndex(group, i)
+            for start, n in chunks:
+                block = dp.datasetValues(index, start, n)
+                if not block.isValid() or block.count() != n:
+                    raise QgsProcessingException("Could not read values {} - {} of dataset {} of group {}".format(
+                        start, start + n - 1, i, meta.name()))
+                values = np.array(block.values(), dtype=float).reshape(n, components)
+                values = values[:, 0] if components == 1 else np.hypot(values[:, 0], values[:, 1])
+                if on_faces:
+                    active = dp.areFacesActive(index, start, n).active()
+                    if len(active) == n:
+                        values[~np.array(active, dtype=bool)] = np.nan
+                stats.add(time, values, start)
+            feedback.setProgress(90. * (i + 1) / len(times))
+
+        outputFiles = []
+        base, ext = os.path.splitext(outputFile)
+        for statistic in statistics:
+            name = TimeStatistics.names[statistic]
+            path = outputFile
+            if len(statistics) > 1:
+                path = "{}_{}{}".format(base, name.lower().replace(' ', '_'), ext)
+            self.writeGroup(dp, path, outputDriver, "{} - {}".format(meta.name(), name), meta, stats.result(statistic))
+            outputFiles.append(path)
+
+        feedback.setProgress(100)
+        return {self.OUTPUT_FILE: outputFiles[0] if outputFiles else outputFile,
+                self.OUTPUT_FILES: outputFiles}
+
+    def writeGroup(self, dp, path, driver, name, meta, values):
+        """ write non-temporal scalar dataset group with a single dataset of values """
+        block = QgsMeshDataBlock(QgsMeshDataBlock.DataType.ScalarDouble, len(values))
+        block.setValues(values.tolist())
+        block.setValid(True)
+
+        finite = values[np.isfinite(values)]
+        minimum, maximum = (float(finite.min()), float(finite.max())) if len(finite) else (0., 0.)
+        outputMeta = QgsMeshDatasetGroupMetadata(name, path, True, meta.dataType(), minimum, maximum, 0,
+                                                 meta.referenceTime(), False, {})
+        # returns true on failure
+        if dp.persistDatasetGroup(path, driver, outputMeta, [block], [], [0.]):
+            raise QgsProcessingException("Could not write dataset group {} to {}".format(name, path))
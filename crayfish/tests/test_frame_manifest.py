@@ -0,0 +1,68 @@
+import os
+
+from ..frame_manifest import FrameManifest, config_hash
+
+
+def test_config_hash():
+    cfg = {'time': (0., 1.), 'img_size': (640, 480), 'tmp_imgfile': '/tmp/a/%05d.png'}
+    assert config_hash(cfg) == config_hash(dict(reversed(list(cfg.items()))))
+    assert config_hash(cfg) != config_hash(dict(cfg, img_size=(800, 600)))
+    # ignored keys do not change the hash
+    assert config_hash(cfg, ['tmp_imgfile']) == config_hash(dict(cfg, tmp_imgfile='/tmp/b/%05d.png'), ['tmp_imgfile'])
+    # objects are converted with default()
+    assert config_hash({'color': object()}, default=lambda v: 'red') == config_hash({'color': 'red'})
+
+
+def _write_frames(template, numbers):
+    for number in numbers:
+        with open(template % number, 'w') as f:
+            f.write('frame')
+
+
+def test_frame_manifest_resume(tmpdir):
+    template = str(tmpdir.join('%05d.png'))
+    path = str(tmpdir.join('manifest.txt'))
+
+    manifest = FrameManifest(path, 'key', template)
+    _write_frames(template, [1, 2, 3])
+    manifest.add(1)
+    manifest.add(2)  # frame 3 is written, but the export was interrupted before recording it
+
+    manifest = FrameManifest(path, 'key', template)
+    assert manifest.has(1) and manifest.has(2)
+    assert not manifest.has(3)
+
+    # recorded frames are written again when their file has been removed
+    os.remove(template % 2)
+    assert not manifest.has(2)
+
+
+def test_frame_manifest_truncated(tmpdir):
+    template = str(tmpdir.join('%05d.png'))
+    path = str(tmpdir.join('manifest.txt'))
+    _write_frames(template, [1, 2])
+    with open(path, 'w') as f:
+        f.write('key\n1\n2x')  # damaged last line
+
+    manifest = FrameManifest(path, 'key', template)
+    assert manifest.has(1)
+    assert not manifest.has(2)
+
+
+def test_frame_manifest_other_key(tmpdir):
+    template = str(tmpdir.join('%05d.png'))
+    path = str(tmpdir.join('manifest.txt'))
+    manifest = FrameManifest(path, 'old', template)
+    _write_frames(template, [1, 2, 3])
+    manifest.add(1)
+    manifest.add(2)
+
+    # frames of an export with another config are removed, unrecorded files are left alone
+    manifest = FrameManifest(path, 'new', template)
+    assert not manifest.has(1)
+    assert not os.path.exists(template % 1)
+    assert not os.path.exists(template % 2)
+    assert os.path.exists(template % 3)
+
+    manifest.add(3)
+    assert FrameManifest(path, 'new', template).frames == {3}
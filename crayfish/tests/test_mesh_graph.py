@@ -0,0 +1,46 @@
+import numpy as np
+
+from ..mesh_graph import EdgeGraph, VertexSnapper
+
+
+def _grid_graph():
+    #  3 - 4 - 5
+    #  |       |
+    #  0 - 1 - 2      6 (isolated)
+    vertices = [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1), (5, 5)]
+    edges = [(0, 1), (1, 2), (0, 3), (3, 4), (4, 5), (5, 2)]
+    return EdgeGraph(vertices, edges)
+
+
+def test_edge_graph_csr():
+    graph = _grid_graph()
+    assert sorted(graph.neighbours(0).tolist()) == [1, 3]
+    assert sorted(graph.neighbours(2).tolist()) == [1, 5]
+    assert len(graph.neighbours(6)) == 0
+    assert graph.indptr[-1] == 12
+
+
+def test_shortest_path():
+    graph = _grid_graph()
+    assert graph.shortest_path(0, 2) == [0, 1, 2]
+    assert graph.shortest_path(3, 5) == [3, 4, 5]
+    assert graph.shortest_path(1, 4) in ([1, 0, 3, 4], [1, 2, 5, 4])
+    assert graph.shortest_path(4, 4) == [4]
+    assert graph.shortest_path(0, 6) is None
+
+
+def test_vertex_snapper():
+    rng = np.random.RandomState(0)
+    vertices = rng.uniform(0, 100, (500, 2))
+    points = rng.uniform(-10, 110, (50, 2))
+
+    for use_kdtree in (True, False):
+        snapper = VertexSnapper(vertices, use_kdtree)
+        for x, y in points:
+            distances = np.hypot(vertices[:, 0] - x, vertices[:, 1] - y)
+            assert snapper.nearest(x, y) == np.argmin(distances)
+            radius = 2.
+            expected = np.argmin(distances) if distances.min() <= radius else -1
+            assert snapper.nearest(x, y, radius) == expected
+
+    assert VertexSnapper(np.empty((0, 2)), False).nearest(0, 0) == -1
@@ -0,0 +1,82 @@
+import numpy as np
+
+from ..mesh_index import TriangleIndex
+from ..utils import barycentric_weights, segment_crossings
+
+
+def grid_mesh(n):
+    """ n x n squares each split into two triangles """
+    xs, ys = np.meshgrid(np.arange(n + 1, dtype=float), np.arange(n + 1, dtype=float), indexing='ij')
+    vertices = np.column_stack((xs.ravel(), ys.ravel()))
+
+    def v(i, j):
+        return i * (n + 1) + j
+
+    triangles = []
+    for i in range(n):
+        for j in range(n):
+            triangles.append((v(i, j), v(i + 1, j), v(i + 1, j + 1)))
+            triangles.append((v(i, j), v(i + 1, j + 1), v(i, j + 1)))
+    return vertices, np.array(triangles)
+
+
+def brute_force(vertices, triangles, xy):
+    found = np.full(len(xy), -1)
+    for k, pt in enumerate(xy):
+        tri = vertices[triangles]
+        w = barycentric_weights(np.repeat([pt], len(triangles), axis=0), tri[:, 0], tri[:, 1], tri[:, 2])
+        inside = np.nonzero(np.isfinite(w[:, 0]))[0]
+        if len(inside):
+            found[k] = inside[0]
+    return found
+
+
+def test_locate():
+    vertices, triangles = grid_mesh(6)
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(-1, 7, (500, 2))
+    index = TriangleIndex(vertices, triangles)
+    found, weights = index.locate(xy)
+    assert np.array_equal(found, brute_force(vertices, triangles, xy))
+    inside = found >= 0
+    assert np.all(~np.isfinite(weights[~inside]))
+    # weights reproduce the located points
+    tri = vertices[triangles[found[inside]]]
+    assert np.allclose(np.einsum('nk,nkd->nd', weights[inside], tri), xy[inside])
+
+
+def test_locate_small_chunks():
+    vertices, triangles = grid_mesh(4)
+    xy = np.array([[0.5, 0.2], [3.9, 3.95], [4., 4.], [5., 1.], [2., 2.]])
+    index = TriangleIndex(vertices, triangles)
+    expected, _ = index.locate(xy)
+    index.CHUNK_SIZE = 2
+    found, _ = index.locate(xy)
+    assert np.array_equal(found, expected)
+    assert np.array_equal(found >= 0, [True, True, True, False, True])
+
+
+def test_locate_empty():
+    index = TriangleIndex(np.empty((0, 2)), np.empty((0, 3), dtype=int))
+    found, weights = index.locate([[0., 0.]])
+    assert found.tolist() == [-1]
+    assert weights.shape == (1, 3)
+
+
+def test_segment_triangles():
+    vertices, triangles = grid_mesh(8)
+    rng = np.random.default_rng(2)
+    index = TriangleIndex(vertices, triangles)
+    all_a = vertices[triangles].reshape(-1, 2)
+    all_b = vertices[triangles[:, [1, 2, 0]]].reshape(-1, 2)
+    segments = np.concatenate((rng.uniform(-1, 9, (50, 2, 2)),
+                               [[[0., 0.], [8., 8.]], [[1., 3.], [5., 3.]], [[2., 0.], [2., 8.]], [[3., 3.], [3., 3.]]]))
+    for p0, p1 in segments:
+        candidates = index.segment_triangles(p0, p1)
+        a = vertices[triangles[candidates]].reshape(-1, 2)
+        b = vertices[triangles[candidates][:, [1, 2, 0]]].reshape(-1, 2)
+        # crossings with edges of the candidates are all the crossings
+        assert np.array_equal(np.unique(segment_crossings(p0, p1, a, b)),
+                              np.unique(segment_crossings(p0, p1, all_a, all_b)))
+    # a short segment has only a few candidates
+    assert len(index.segment_triangles([0.2, 0.2], [0.4, 0.3])) < 10
@@ -0,0 +1,35 @@
+import numpy as np
+
+from ..time_statistics import TimeStatistics
+
+
+def test_time_statistics():
+    times = [0., 1., 2., 4.]
+    values = np.array([[1., 3., 2., 0.],
+                       [np.nan, 5., np.nan, 1.],
+                       [2., 2., np.nan, 2.],
+                       [np.nan] * 4])
+    stats = TimeStatistics(4, threshold=1.5)
+    for time, column in zip(times, values.T):
+        stats.add(time, column)
+
+    assert np.allclose(stats.result(TimeStatistics.MAXIMUM), [3, 5, 2, np.nan], equal_nan=True)
+    assert np.allclose(stats.result(TimeStatistics.MINIMUM), [0, 1, 2, np.nan], equal_nan=True)
+    assert np.allclose(stats.result(TimeStatistics.MEAN), [1.5, 3, 2, np.nan], equal_nan=True)
+    assert np.allclose(stats.result(TimeStatistics.TIME_OF_MAXIMUM), [1, 1, 0, np.nan], equal_nan=True)
+    # crossing at 0.25, above until 2 + 0.5 / 2 * 2;
+    # intervals next to NaN timesteps (e.g. dry faces) are not counted even if values around are above
+    assert np.allclose(stats.result(TimeStatistics.DURATION_ABOVE), [0.75 + 1 + 0.5, 0, 1, np.nan], equal_nan=True)
+
+
+def test_time_statistics_blocks():
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0, 1, (10, 6))
+    whole, blocks = TimeStatistics(10, 0.5), TimeStatistics(10, 0.5)
+    for t in range(values.shape[1]):
+        whole.add(t, values[:, t])
+        blocks.add(t, values[:4, t], start=0)
+        blocks.add(t, values[4:, t], start=4)
+    for statistic in range(len(TimeStatistics.names)):
+        assert np.allclose(whole.result(statistic), blocks.result(statistic))
+    assert np.allclose(whole.result(TimeStatistics.MEAN), values.mean(axis=1))
@@ -0,0 +1,68 @@
+import numpy as np
+
+from ..timeseries_store import TimeSeriesStore, series_key, quantize
+
+
+def test_series_key():
+    assert series_key('timeseries', 1, (2, 3)) == series_key('timeseries', 1, (2, 3))
+    assert series_key('timeseries', 1, (2, 3)) != series_key('integral', 1, (2, 3))
+
+
+def test_quantize():
+    assert quantize([1.0, 2.0], 0.1) == quantize([1.00001, 1.99999], 0.1)
+    assert quantize([1.0, 2.0], 0.1) != quantize([1.1, 2.0], 0.1)
+
+
+def test_store_get_put(tmpdir):
+    store = TimeSeriesStore(str(tmpdir.join('cache', 'store.sqlite')), 1024 * 1024)
+    assert store.get('a') is None
+
+    times = np.arange(5, dtype=float)
+    values = np.array([1., np.nan, 3., 4., 5.])
+    store.put('a', times, values)
+
+    x, y = store.get('a')
+    assert np.array_equal(x, times)
+    assert np.array_equal(y, values, equal_nan=True)
+    assert store.size() == times.nbytes + values.nbytes
+
+    store.clear()
+    assert store.get('a') is None
+
+
+def test_store_eviction(tmpdir):
+    times = np.arange(8, dtype=float)
+    size = 2 * times.nbytes
+    store = TimeSeriesStore(str(tmpdir.join('store.sqlite')), 2 * size)
+
+    store.put('a', times, times)
+    store.put('b', times, times)
+    store.get('a')                 # 'b' is now the least recently used
+    store.put('c', times, times)
+
+    assert store.get('a') is not None
+    assert store.get('b') is None
+    assert store.get('c') is not None
+    assert store.size() <= 2 * size
+
+    # too big to be stored at all
+    store.put('d', np.arange(100, dtype=float), np.arange(100, dtype=float))
+    assert store.get('d') is None
+
+
+def test_store_get_many(tmpdir):
+    path = str(tmpdir.join('store.sqlite'))
+    store = TimeSeriesStore(path, 1024 * 1024)
+    times = np.arange(3, dtype=float)
+    store.put('a', times, times)
+    store.put('b', times, 2 * times)
+
+    found = store.get_many(['a', 'b', 'c'])
+    assert sorted(found) == ['a', 'b']
+    assert np.array_equal(found['b'][1], 2 * times)
+
+    # series are persisted after close
+    store.close()
+    store = TimeSeriesStore(path, 1024 * 1024)
+    assert store.get('a') is not None
+    store.close()
@@ -1,5 +1,10 @@
 import math
-from ..utils import integrate
+
+import numpy as np
+
+from ..utils import integrate, barycentric_weights, index_ranges, segment_crossings, resample_regular, \
+    pad_ragged, pad_columns, depth_average, vector_depth_average, split_ranges, regular_positions, \
+    column_mesh
 
 
 def test_integrate():
@@ -20,7 +25,114 @@ def test_integrate_with_nan():
     assert integrate(x, y) == value
 
 
+def test_integrate_2d():
+    x = np.arange(1, 10, dtype=float)
+    y = np.vstack((x, 2 * x, np.full(len(x), np.nan)))
+    y[1, 4] = math.nan
+    value = (x[-1]*x[-1]-x[0]*x[0])/2
+    part1 = x[3]*x[3]-x[0]*x[0]
+    part2 = x[-1]*x[-1]-x[5]*x[5]
+    assert np.allclose(integrate(x, y, axis=1), [value, part1 + part2, 0])
+    assert np.allclose(integrate(x, y.T, axis=0), [value, part1 + part2, 0])
+
+
 def test_integrate_fail():
     x = list(range(1, 10))
     y = list(range(1, 9))
     assert integrate(x, y) is None
+
+
+def test_barycentric_weights():
+    a = [(0, 0), (0, 0)]
+    b = [(2, 0), (2, 0)]
+    c = [(0, 2), (0, 2)]
+    weights = barycentric_weights([(0.5, 0.5), (3, 3)], a, b, c)
+    assert np.allclose(weights[0], [0.5, 0.25, 0.25])
+    assert np.all(np.isnan(weights[1]))
+
+
+def test_index_ranges():
+    assert index_ranges([]) == []
+    assert index_ranges([1, 2, 3, 7, 8, 20]) == [(1, 3), (7, 2), (20, 1)]
+    assert index_ranges([1, 2, 3, 7, 8, 20], max_gap=3) == [(1, 8), (20, 1)]
+
+
+def test_segment_crossings():
+    a = [(1, -1), (2, -1), (5, -1), (0, 1)]
+    b = [(1, 1), (3, 1), (5, -0.5), (4, 1)]
+    assert np.allclose(segment_crossings((0, 0), (4, 0), a, b), [0.25, 0.625])
+
+
+def test_resample_regular():
+    x = [0., 1., 1., 3.]   # with a step at 1
+    values = np.array([[0., 1., 5., 7.], [1., 1., 1., 1.]])
+    xs, resampled = resample_regular(x, values, 4, axis=1)
+    assert np.allclose(xs, [0, 1, 2, 3])
+    assert np.allclose(resampled, [[0, 5, 6, 7], [1, 1, 1, 1]])
+
+    xs, resampled = resample_regular(x, values.T, 7, axis=0)
+    assert resampled.shape == (7, 2)
+    assert np.allclose(resampled[:, 0], [0, 0.5, 5, 5.5, 6, 6.5, 7])
+
+
+def test_pad_ragged():
+    padded = pad_ragged([1, 2, 3, 4, 5, 6], [1, 0, 3, 2])
+    assert padded.shape == (4, 3)
+    assert np.array_equal(padded, [[1, np.nan, np.nan], [np.nan] * 3, [2, 3, 4], [5, 6, np.nan]], equal_nan=True)
+    assert pad_ragged([1, 2], [2], width=4).shape == (1, 4)
+
+
+def test_pad_columns():
+    padded = pad_columns([[1, 2], [3, 4]], 3)
+    assert np.array_equal(padded, [[1, 2, np.nan], [3, 4, np.nan]], equal_nan=True)
+    assert pad_columns(np.empty((2, 0)), 2).shape == (2, 2)
+
+
+def test_depth_average():
+    levels = np.array([[0., -1., -3., np.nan], [5., 4., 2., 0.]])
+    values = np.array([[1., 4., np.nan], [3., np.nan, 6.]])
+    # thickness weighted, NaN volumes ignored
+    assert np.allclose(depth_average(levels, values), [(1 + 2 * 4) / 3, (3 + 2 * 6) / 3])
+    # only the part of the column in range counts
+    assert np.allclose(depth_average(levels, values, [-2, 1], [-0.5, 4.5]), [(0.5 * 1 + 4) / 1.5, (0.5 * 3 + 6) / 1.5])
+    assert np.isnan(depth_average(levels, values, 10, 20)).all()
+
+
+def test_vector_depth_average():
+    levels = np.array([[0., -1., -2.]])
+    # opposing vectors cancel out, the average of magnitudes would be 1
+    x, y = np.array([[1., -1.]]), np.array([[0., 0.]])
+    assert np.allclose(vector_depth_average(levels, [x, y]), [0.])
+    assert np.allclose(depth_average(levels, np.hypot(x, y)), [1.])
+    assert np.allclose(vector_depth_average(levels, [np.array([[3., 0.]]), np.array([[0., 4.]])]), [2.5])
+    # a single component is a scalar
+    assert np.allclose(vector_depth_average(levels, [np.array([[1., -1.]])]), [0.])
+
+
+def test_split_ranges():
+    assert split_ranges([(0, 5), (10, 2)], 2) == [(0, 2), (2, 2), (4, 1), (10, 2)]
+    assert split_ranges([(3, 4)], 10) == [(3, 4)]
+    assert split_ranges([(3, 2)], 0) == [(3, 1), (4, 1)]
+
+
+def test_regular_positions():
+    x = np.array([0., 1., 1., 4.])
+    xs, i, w = regular_positions(x, 5)
+    assert np.allclose(xs, [0, 1, 2, 3, 4])
+    values = x * 10
+    assert np.allclose(values[i] * (1 - w) + values[i + 1] * w, xs * 10)
+
+
+def test_column_mesh():
+    levels = np.array([[0., -1., -3.], [1., 0., np.nan], [np.nan, np.nan, np.nan]])
+    values = np.array([[1., 2.], [5., np.nan], [np.nan, np.nan]])
+    xs, ys, zs = column_mesh([0., 2., 3.], levels, values)
+    assert xs.shape == ys.shape == (6, 3) and zs.shape == (5, 2)
+    # columns span half way to the neighbours
+    assert np.allclose(xs[:, 0], [-1, 1, 1, 2.5, 2.5, 3.5])
+    # missing top boundary repeats the last one, empty column has zero height
+    assert np.allclose(ys[2:4], [[1, 0, 0], [1, 0, 0]])
+    assert np.ptp(ys[4:]) == 0
+    # gaps between columns and cells without value get the lowest value
+    assert np.allclose(zs, [[1, 2], [1, 1], [5, 1], [1, 1], [1, 1]])
+    assert column_mesh([], np.empty((0, 1)), np.empty((0, 0)))[2].shape == (0, 0)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from ..utils import integrate
+
+pytest.importorskip('pytest_benchmark')
+
+
+def _line(stations, nan_ratio=0.05, seed=0):
+    rng = np.random.RandomState(seed)
+    x = np.cumsum(rng.uniform(0.1, 1., stations))
+    y = rng.uniform(-1., 1., stations)
+    y[rng.uniform(size=stations) < nan_ratio] = np.nan
+    return x, y
+
+
+def test_benchmark_integrate_1d(benchmark):
+    x, y = _line(100000)
+    benchmark(integrate, x, y)
+
+
+def test_benchmark_integrate_2d(benchmark):
+    x, y = _line(2000)
+    values = np.tile(y, (5000, 1))
+    result = benchmark(integrate, x, values, 1)
+    assert result.shape == (5000,)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import numpy as np
+
+
+class TimeStatistics:
+    """ running statistics of values of mesh elements over time
+
+    Timesteps are added one by one (possibly in blocks of elements),
+    so the memory used does not depend on the number of timesteps.
+    NaN values (e.g. inactive faces) are ignored, durations are counted only
+    over intervals between consecutive timesteps with valid values """
+
+    MAXIMUM, MINIMUM, MEAN, TIME_OF_MAXIMUM, DURATION_ABOVE = range(5)
+
+    names = ["Maximum", "Minimum", "Mean", "Time of maximum", "Duration above threshold"]
+
+    def __init__(self, count, threshold=0.):
+        self.threshold = threshold
+        self.maximum = np.full(count, -np.inf)
+        self.minimum = np.full(count, np.inf)
+        self.total = np.zeros(count)
+        self.samples = np.zeros(count, dtype=np.int64)
+        self.time_of_maximum = np.full(count, np.nan)
+        self.duration = np.zeros(count)
+        self.previous_time = np.full(count, np.nan)
+        self.previous_value = np.full(count, np.nan)
+
+    def add(self, time, values, start=0):
+        """ add values of elements start, start + 1, ... at the time,
+        times of the elements must be added in increasing order """
+        values = np.asarray(values, dtype=float)
+        s = slice(start, start + len(values))
+        valid = np.isfinite(values)
+
+        higher = valid & (values > self.maximum[s])
+        self.maximum[s] = np.where(higher, values, self.maximum[s])
+        self.time_of_maximum[s] = np.where(higher, time, self.time_of_maximum[s])
+        self.minimum[s] = np.where(valid & (values < self.minimum[s]), values, self.minimum[s])
+        self.total[s] += np.where(valid, values, 0.)
+        self.samples[s] += valid
+
+        # the part of the interval from the previous timestep above the threshold, values change linearly
+        previous = self.previous_value[s]
+        interval = time - self.previous_time[s]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            a, b = previous - self.threshold, values - self.threshold
+            both_above = (a > 0) & (b > 0)
+            crossing = (a > 0) != (b > 0)
+            fraction = np.where(both_above, 1., np.where(crossing, np.maximum(a, b) / np.abs(b - a), 0.))
+        counted = np.isfinite(previous) & valid & np.isfinite(interval)
+        self.duration[s] += np.where(counted, fraction * interval, 0.)
+
+        # intervals with an invalid end (e.g. a dry face) are never counted
+        self.previous_time[s] = np.where(valid, time, np.nan)
+        self.previous_value[s] = np.where(valid, values, np.nan)
+
+    def result(self, statistic):
+        """ return array with the statistic of the elements, NaN for elements without any valid value """
+        empty = self.samples == 0
+        if statistic == self.MAXIMUM:
+            values = self.maximum
+        elif statistic == self.MINIMUM:
+            values = self.minimum
+        elif statistic == self.MEAN:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = self.total / self.samples
+        elif statistic == self.TIME_OF_MAXIMUM:
+            values = self.time_of_maximum
+        elif statistic == self.DURATION_ABOVE:
+            values = self.duration
+        else:
+            raise ValueError("Unknown statistic {}".format(statistic))
+        return np.where(empty, np.nan, values)
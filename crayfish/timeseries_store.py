@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Crayfish - A collection of tools for TUFLOW and other hydraulic modelling packages
+# Copyright (C) 2016 Lutra Consulting
+
+# info at lutraconsulting dot co dot uk
+# Lutra Consulting
+# 23 Chestnut Close
+# Burgess Hill
+# West Sussex
+# RH15 8HN
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+def series_key(*parts):
+    """ return key of a stored series made of hashable parts (strings, numbers, tuples) """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def quantize(coords, quantum):
+    """ return tuple of coordinates rounded to multiples of quantum,
+    so tiny differences in picked locations do not produce different keys """
+    return tuple(int(v) for v in np.round(np.asarray(coords, dtype=float).ravel() / quantum))
+
+
+class TimeSeriesStore:
+    """ SQLite file with computed series (times and values arrays)
+
+    The least recently used series are removed when the total size
+    of stored arrays exceeds max_size bytes. The store keeps a single connection
+    guarded by a lock, so it can be used from worker threads. Access times of looked up
+    series are kept in memory and written together with the next put() or on close() """
+
+    # maximum number of keys bound in a single query (SQLite limits host parameters)
+    QUERY_KEYS = 500
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._accessed = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._con = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        with self._con:
+            self._con.execute("CREATE TABLE IF NOT EXISTS series "
+                              "(key TEXT PRIMARY KEY, times BLOB, vals BLOB, size INTEGER, accessed REAL)")
+            self._con.execute("CREATE INDEX IF NOT EXISTS series_accessed ON series (accessed)")
+
+    def get(self, key):
+        """ return (times, values) arrays stored under the key or None """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """ return dict of key -> (times, values) arrays for keys which are stored """
+        keys = list(set(keys))
+        result = {}
+        with self._lock:
+            for i in range(0, len(keys), self.QUERY_KEYS):
+                chunk = keys[i:i + self.QUERY_KEYS]
+                rows = self._con.execute("SELECT key, times, vals FROM series WHERE key IN ({})".format(
+                    ", ".join("?" * len(chunk))), chunk)
+                for key, times, vals in rows:
+                    result[key] = np.frombuffer(times, dtype=np.float64), np.frombuffer(vals, dtype=np.float64)
+
+            now = time.time()
+            self._accessed.update((key, now) for key in result)
+        return result
+
+    def put(self, key, times, values):
+        """ store times and values arrays under the key and evict old series if needed """
+        times = np.ascontiguousarray(times, dtype=np.float64)
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        size = times.nbytes + values.nbytes
+        if size > self.max_size:
+            return
+
+        with self._lock, self._con:
+            self._accessed.pop(key, None)
+            self._write_accessed()
+            self._con.execute("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)",
+                              (key, times.tobytes(), values.tobytes(), size, time.time()))
+            self._evict()
+
+    def _write_accessed(self):
+        if self._accessed:
+            self._con.executemany("UPDATE series SET accessed = ? WHERE key = ?",
+                                  [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        total = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM series").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        removed = []
+        for key, size in self._con.execute("SELECT key, size FROM series ORDER BY accessed, rowid"):
+            if total <= self.max_size:
+                break
+            removed.append((key,))
+            total -= size
+        self._con.executemany("DELETE FROM series WHERE key = ?", removed)
+
+    def size(self):
+        """ return total size of stored arrays in bytes """
+        with self._lock:
+            return self._con.execute("SELECT COALESCE(SUM(size), 0) FROM series").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._con:
+            self._accessed.clear()
+            self._con.execute("DELETE FROM series")
+
+    def close(self):
+        """ write pending access times and close the connection """
+        with self._lock:
+            with self._con:
+                self._write_accessed()
+            self._con.close()
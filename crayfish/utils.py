@@ -24,7 +24,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import math
+import numpy as np
 
 def decimalPrecision(x):
     """
@@ -39,32 +39,282 @@ def decimalPrecision(x):
         return 0
 
 
-def integrate(x, y):
+def integrate(x, y, axis=-1):
     """
-    Calculate approximate value of integral for x,y arrays.
+    Calculate integral of y(x) with the trapezoidal rule.
     Arrays containing NaN values will be split into parts.
 
-    :param x: list of x points
-    :param y: list of f(x) points
-    :return: value of integration
+    :param x: array of x points, 1-D or with the same shape as y
+    :param y: array of f(x) points, for N-D array all lines along axis are integrated
+    :param axis: axis of y along which to integrate
+    :return: value of integration, array of values for N-D y
     """
-    if len(x) != len(y):
+    x = np.asarray(x, dtype=float)
+    y = np.moveaxis(np.asarray(y, dtype=float), axis, -1)
+    if x.ndim > 1:
+        x = np.moveaxis(x, axis, -1)
+    if x.shape[-1] != y.shape[-1] or (x.ndim > 1 and x.shape != y.shape):
         return
-    # calculate parts where f(x) is not NaN
-    parts = []
-    _x, _y = [], []
-    for index, i in enumerate(y):
-        if not math.isnan(i) and not math.isnan(x[index]):
-            _x.append(x[index])
-            _y.append(y[index])
-        else:
-            parts.append([_x, _y])
-            _x, _y = [], []
-    parts.append([_x, _y])
-
-    # approximated integral(a,b) f(x) as (b-a)/N sum(0,N) f(x_n)
-    integral = 0
-    for part in parts:
-        if len(part[1]):
-            integral += sum(part[1]) * (part[0][-1]-part[0][0]) / len(part[1])
-    return integral
+
+    # only segments with both ends valid contribute, NaN splits the line into parts
+    valid = np.isfinite(x) & np.isfinite(y)
+    segment_valid = valid[..., :-1] & valid[..., 1:]
+    with np.errstate(invalid='ignore'):
+        segments = np.diff(x, axis=-1) * (y[..., :-1] + y[..., 1:]) / 2
+    integral = np.where(segment_valid, segments, 0.).sum(axis=-1)
+    return float(integral) if integral.ndim == 0 else integral
+
+
+def barycentric_weights(points, a, b, c, tolerance=1e-9):
+    """
+    Calculate barycentric coordinates of points in triangles a, b, c.
+    Points outside of their triangle get NaN weights.
+
+    :param points: (n, 2) array of x,y points
+    :param a: (n, 2) array of first triangle vertices
+    :param b: (n, 2) array of second triangle vertices
+    :param c: (n, 2) array of third triangle vertices
+    :param tolerance: how much can a weight be negative for point still considered inside
+    :return: (n, 3) array of weights for a, b, c
+    """
+    points, a, b, c = [np.asarray(arr, dtype=float).reshape(-1, 2) for arr in (points, a, b, c)]
+    v0 = b - a
+    v1 = c - a
+    v2 = points - a
+    det = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wb = (v2[:, 0] * v1[:, 1] - v1[:, 0] * v2[:, 1]) / det
+        wc = (v0[:, 0] * v2[:, 1] - v2[:, 0] * v0[:, 1]) / det
+    weights = np.column_stack((1. - wb - wc, wb, wc))
+
+    # points on the triangle edges may end up slightly outside due to rounding
+    outside = np.any(weights < -tolerance, axis=1) | ~np.isfinite(det) | (det == 0)
+    weights = np.clip(weights, 0., 1.)
+    weights /= weights.sum(axis=1)[:, np.newaxis]
+    weights[outside] = np.nan
+    return weights
+
+
+def index_ranges(indices, max_gap=0):
+    """
+    Split sorted unique indices into contiguous (start, count) ranges.
+    Ranges separated by less than max_gap unused indices are merged,
+    so that fewer (but longer) reads are needed to fetch all the indices.
+
+    :param indices: sorted array of unique non-negative indices
+    :param max_gap: number of unused indices allowed inside of a range
+    :return: list of (start, count) tuples
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return []
+    breaks = np.nonzero(np.diff(indices) > max_gap + 1)[0]
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks], [indices[-1]])) + 1
+    return [(int(s), int(e - s)) for s, e in zip(starts, ends)]
+
+
+def split_ranges(ranges, max_count):
+    """
+    Split (start, count) ranges into ranges with at most max_count indices.
+
+    :param ranges: list of (start, count) tuples
+    :param max_count: maximum count of a range, at least 1
+    :return: list of (start, count) tuples
+    """
+    max_count = max(int(max_count), 1)
+    return [(start + offset, min(max_count, count - offset))
+            for start, count in ranges for offset in range(0, count, max_count)]
+
+
+def segment_crossings(p0, p1, a, b):
+    """
+    Find where segment p0-p1 crosses segments a-b.
+    Collinear overlapping segments are not reported.
+
+    :param p0: x,y start of the segment
+    :param p1: x,y end of the segment
+    :param a: (n, 2) array of starts of the other segments
+    :param b: (n, 2) array of ends of the other segments
+    :return: sorted array of crossing parameters t in [0, 1] along p0-p1
+    """
+    p0, p1 = np.asarray(p0, dtype=float), np.asarray(p1, dtype=float)
+    a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+    d = p1 - p0
+    e = b - a
+    f = a - p0
+    denom = d[0] * e[:, 1] - d[1] * e[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (f[:, 0] * e[:, 1] - f[:, 1] * e[:, 0]) / denom
+        s = (f[:, 0] * d[1] - f[:, 1] * d[0]) / denom
+    valid = (denom != 0) & (t >= 0) & (t <= 1) & (s >= 0) & (s <= 1)
+    return np.sort(t[valid])
+
+
+def regular_positions(x, n):
+    """
+    Find where regularly spaced coordinates lie between sorted coordinates x.
+    Repeated coordinates (steps) are allowed, the last one of the step is used.
+
+    :param x: sorted coordinates, at least two
+    :param n: number of the regularly spaced coordinates
+    :return: tuple of n coordinates between x[0] and x[-1], indexes i of x
+             and weights w, so that a value is interpolated as v[i] * (1 - w) + v[i + 1] * w
+    """
+    x = np.asarray(x, dtype=float)
+    xs = np.linspace(x[0], x[-1], n)
+    i = np.clip(np.searchsorted(x, xs, side='right') - 1, 0, len(x) - 2)
+    dx = x[i + 1] - x[i]
+    w = np.where(dx > 0, (xs - x[i]) / np.where(dx > 0, dx, 1), 0)
+    return xs, i, w
+
+
+def resample_regular(x, values, n, axis=-1):
+    """
+    Linearly interpolate values to regularly spaced coordinates.
+    Repeated coordinates (steps) are allowed, the last value of the step is used.
+
+    :param x: sorted coordinates of values along the axis
+    :param values: array of values
+    :param n: number of the regularly spaced coordinates
+    :param axis: axis of values along which x goes
+    :return: tuple of n coordinates between x[0] and x[-1] and resampled values
+    """
+    x = np.asarray(x, dtype=float)
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, -1)
+    if len(x) < 2:
+        return x, np.moveaxis(values, -1, axis)
+
+    xs, i, w = regular_positions(x, n)
+    resampled = values[..., i] * (1 - w) + values[..., i + 1] * w
+    return xs, np.moveaxis(resampled, -1, axis)
+
+
+def pad_ragged(flat, counts, width=None):
+    """
+    Split flat array into rows of given lengths, padded with NaN to the same width.
+
+    :param flat: 1-D array with all rows concatenated
+    :param counts: lengths of the rows
+    :param width: width of the result, by default the length of the longest row
+    :return: (len(counts), width) array
+    """
+    flat = np.asarray(flat, dtype=float)
+    counts = np.asarray(counts, dtype=np.int64)
+    if width is None:
+        width = int(counts.max()) if len(counts) else 0
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    columns = np.arange(width)
+    inside = columns < counts[:, np.newaxis]
+    padded = np.full((len(counts), width), np.nan)
+    padded[inside] = flat[(offsets[:, np.newaxis] + columns)[inside]]
+    return padded
+
+
+def pad_columns(arr, width):
+    """
+    Pad 2-D array with NaN columns on the right.
+
+    :param arr: (rows, columns) array with at most width columns
+    :param width: width of the result
+    :return: (rows, width) array
+    """
+    arr = np.asarray(arr, dtype=float)
+    return np.pad(arr, ((0, 0), (0, width - arr.shape[1])), constant_values=np.nan)
+
+
+def depth_average(levels, values, lower=-np.inf, upper=np.inf):
+    """
+    Average values of volumes in vertical columns, weighted by thickness
+    of the parts of the volumes between lower and upper height.
+
+    :param levels: (..., n + 1) array of heights of volume boundaries, NaN padded
+    :param values: (..., n) array of values in volumes, NaN padded
+    :param lower: lowest height included, scalar or array with shape of the columns
+    :param upper: highest height included, scalar or array with shape of the columns
+    :return: array of averages, NaN for columns without any valid volume in range
+    """
+    levels = np.asarray(levels, dtype=float)
+    values = np.asarray(values, dtype=float)
+    lower = np.asarray(lower, dtype=float)[..., np.newaxis]
+    upper = np.asarray(upper, dtype=float)[..., np.newaxis]
+
+    bottom = np.minimum(levels[..., :-1], levels[..., 1:])
+    top = np.maximum(levels[..., :-1], levels[..., 1:])
+    with np.errstate(invalid='ignore'):
+        thickness = np.minimum(top, upper) - np.maximum(bottom, lower)
+        valid = np.isfinite(thickness) & np.isfinite(values) & (thickness > 0)
+    weights = np.where(valid, thickness, 0.)
+    total = weights.sum(axis=-1)
+    weighted = np.where(valid, values, 0.) * weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = weighted.sum(axis=-1) / total
+    return np.where(total > 0, average, np.nan)
+
+
+def vector_depth_average(levels, components, lower=-np.inf, upper=np.inf):
+    """
+    Average vectors in vertical columns like QgsMesh3dAveragingMethod does:
+    each component is averaged on its own and the magnitude is taken only then.
+
+    :param levels: (..., n + 1) array of heights of volume boundaries, NaN padded
+    :param components: list of (..., n) arrays with components of values in volumes,
+                       a single scalar component is just averaged
+    :param lower: lowest height included, scalar or array with shape of the columns
+    :param upper: highest height included, scalar or array with shape of the columns
+    :return: array of averages, NaN for columns without any valid volume in range
+    """
+    averages = [depth_average(levels, component, lower, upper) for component in components]
+    return averages[0] if len(averages) == 1 else np.hypot(*averages)
+
+
+def column_mesh(x, levels, values):
+    """
+    Build corners and cell values of a color mesh with columns of cells
+    with non-uniform vertical boundaries (e.g. volumes of 3D mesh over time).
+
+    Cells with NaN levels and NaN values at the bottom or the top of a column (e.g. whole
+    columns of inactive faces) get zero height. The color mesh cannot leave out cells inside
+    a column, NaN values between valid ones get the lowest finite value.
+
+    :param x: sorted positions of the columns
+    :param levels: (columns, cells + 1) array of heights of cell boundaries, NaN padded
+    :param values: (columns, cells) array of values in cells, NaN padded
+    :return: tuple of (2 * columns, cells + 1) x and y coordinates of the corners
+             and (2 * columns - 1, cells) values, every column has its own left and right
+             row of corners and cells between columns have zero width
+    """
+    x = np.asarray(x, dtype=float)
+    levels = np.asarray(levels, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return np.empty((0, 1)), np.empty((0, 1)), np.empty((0, 0))
+    finite = values[np.isfinite(values)]
+    lo = finite.min() if len(finite) else 0.
+
+    # each column spans half way to its neighbours
+    if len(x) > 1:
+        middles = (x[:-1] + x[1:]) / 2
+        left = np.concatenate(([2 * x[0] - middles[0]], middles))
+        right = np.concatenate((middles, [2 * x[-1] - middles[-1]]))
+    else:
+        left, right = x - 0.5, x + 0.5
+
+    # missing boundaries repeat the last valid one, so the cells without values have zero height
+    columns = np.arange(levels.shape[1])
+    last_valid = np.maximum.accumulate(np.where(np.isfinite(levels), columns, 0), axis=1)
+    levels = np.nan_to_num(np.take_along_axis(levels, last_valid, axis=1))
+
+    # cells below the first and above the last valid value of a column get zero height too
+    valid = np.isfinite(values)
+    first = np.argmax(valid, axis=1)
+    last = values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    empty = ~valid.any(axis=1)
+    first[empty], last[empty] = 0, -1
+    levels = np.take_along_axis(levels, np.clip(columns, first[:, None], last[:, None] + 1), axis=1)
+
+    xs = np.repeat(np.column_stack((left, right)).ravel(), levels.shape[1]).reshape(-1, levels.shape[1])
+    ys = np.repeat(levels, 2, axis=0)
+    zs = np.full((len(xs) - 1, values.shape[1]), lo, dtype=float)
+    zs[::2] = np.where(valid, values, lo)
+    return xs, ys, zs